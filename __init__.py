@@ -7,6 +7,14 @@ from .config import Config
 from .gui import ImporterGui
 from .logger import log_info
 
+# Delay after collection load before the first auto-import, so startup is not slowed down (ms)
+AUTO_IMPORT_STARTUP_DELAY = 15000
+# How often the periodic auto-import checks whether its interval has passed (ms)
+AUTO_IMPORT_TICK = 60000
+
+auto_importer = None
+auto_import_timer = None
+
 
 def initialize_config():
     """ Ensure config file exists with all necessary keys """
@@ -16,6 +24,7 @@ def initialize_config():
         'parents_only': False,
         'empty_translation': False,
         'allow_duplicates': False,
+        'update_existing': False,
         'import_tags': False,
         'selected_deck': 'Default',
         'selected_model': 'Basic',
@@ -24,7 +33,16 @@ def initialize_config():
         'selected_lang': 0,
         'last_days': 0,
         'tags': [],
-        'auto_import': False
+        'auto_import': False,
+        'full_resync': False,
+        'snapshot_db': False,
+        'auto_import_interval': 0,
+        'sync_cursors': {},
+        'route_languages': False,
+        'language_routes': {},
+        'import_images': False,
+        'lute_sources': [],
+        'well_known_cards': ''
     }
     current_config = config.get_config()
 
@@ -32,20 +50,25 @@ def initialize_config():
     missing_keys = {k: v for k, v in default_config.items() if k not in current_config}
     if missing_keys:
         config.update_config(missing_keys)
-        log_info(f'[init] Configuration initialized with default values for {missing_keys}')
+        log_info('[init] Configuration initialized with default values for %s', missing_keys)
 
 
 def auto_import_on_startup():
-    """Safely run automatic import only once after collection is loaded."""
+    """Schedule background auto-import after startup and then periodically."""
+    global auto_importer, auto_import_timer
     if mw.col is None:
         log_info('[init] Anki collection not loaded. Auto-import skipped.')
         return
 
-    config = Config()
-    if config.get_config_param('auto_import'):
-        importer = AutoImporter(config)
-        importer.run_import()
-        log_info('[init] Auto-import on startup executed.')
+    # Stopping the timer of a previously loaded profile
+    if auto_import_timer is not None:
+        auto_import_timer.stop()
+
+    auto_importer = AutoImporter(Config())
+    mw.progress.single_shot(AUTO_IMPORT_STARTUP_DELAY, auto_importer.run_in_background)
+    auto_import_timer = mw.progress.timer(AUTO_IMPORT_TICK, auto_importer.run_if_due, True,
+                                          parent=mw)
+    log_info('[init] Auto-import scheduled after startup.')
 
 
 def show_importer():
@@ -56,6 +79,7 @@ def show_importer():
 
     # Refresh Anki after closing the GUI
     def on_close(event):
+        mw.myWidget.config.flush()
         mw.reset()
         event.accept()
 
@@ -72,7 +96,7 @@ def on_collection_loaded(_):
     qconnect(action.triggered, show_importer)
     mw.form.menuTools.addAction(action)
 
-    # Run the auto-import exactly once after collection is ready
+    # Schedule the auto-import in the background once Anki has finished starting up
     auto_import_on_startup()
 
 
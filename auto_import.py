@@ -1,51 +1,66 @@
 # auto_import.py
-from datetime import date, timedelta
-from aqt.utils import showInfo
-from .database import LuteDatabase
-from .logger import log_debug, log_error, log_info
-from .note_creator import NoteCreator
+import time
+from anki.collection import OpChanges
+from aqt import gui_hooks, mw
+from aqt.operations import QueryOp
+from aqt.utils import tooltip
+from .engine import ImportEngine
+from .logger import log_error
+
+# How long the result tooltip stays visible (ms)
+TOOLTIP_PERIOD = 5000
 
 
 class AutoImporter:
     def __init__(self, config):
         self.config = config
+        self.running = False
+        self.last_run = None
+        self.message = ''
+
+    def run_in_background(self):
+        """ Starts auto-import in a background operation if enabled """
+        self.last_run = time.monotonic()
+        if self.running or mw.col is None or not self.config.get_config_param('auto_import'):
+            return
+
+        self.running = True
+        # Without a progress window, so periodic imports do not interrupt reviews
+        op = QueryOp(parent=mw, op=self.run_import, success=self.on_finished)
+        op.failure(self.on_failed)
+        op.run_in_background()
+
+    def run_if_due(self):
+        """ Called periodically, runs auto-import when the configured interval has passed """
+        # interval in minutes, 0 means auto-import runs only once after startup
+        interval = self.config.get_config_param('auto_import_interval')
+        if not interval or self.last_run is None:
+            return
+        if time.monotonic() - self.last_run >= interval * 60:
+            self.run_in_background()
+
+    def on_finished(self, changes: OpChanges):
+        """ Refreshes Anki's screens and undo menu, reports result with a non-modal tooltip """
+        self.running = False
+        # A QueryOp does not report collection changes like a CollectionOp does
+        gui_hooks.operation_did_execute(changes, None)
+        mw.update_undo_actions()
+        if self.message:
+            tooltip(self.message, period=TOOLTIP_PERIOD)
+
+    def on_failed(self, error: Exception):
+        self.running = False
+        log_error('[auto_import] Auto-import failed: %s', error)
+        tooltip(f'LUTE auto-import failed: {error}', period=TOOLTIP_PERIOD)
 
-    def run_import(self):
-        try:
-            db_path = self.config.get_config_param('lutedb_path')
-            log_debug(f'[auto import] Loaded db path: {db_path}')
-            if db_path == 'Open file manager':
-                log_error('[auto_import] Auto-import failed: LUTE database path is not set.')
-                return
-
-            log_info('[auto_import] Starting auto-import from LUTE database.')
-            db = LuteDatabase(db_path)
-            terms, languages = db.connect(
-                self.config.get_config_param('parents_only'),
-                self.config.get_config_param('empty_translation'),
-                self.config.get_config_param('include_WKI'),
-                date.today() - timedelta(days=self.config.get_config_param('last_days'))
-            )
-
-            if terms:
-                # Adding new terms to Anki based on config.json settings
-                selected_lang = self.config.get_config_param('selected_lang')
-                selected_deck = self.config.get_config_param('selected_deck')
-                creator = NoteCreator(
-                    model_name=self.config.get_config_param('selected_model'),
-                    deck_name=self.config.get_config_param('selected_deck'),
-                    allow_duplicates=self.config.get_config_param('allow_duplicates'),
-                    import_tags=self.config.get_config_param('import_tags'),
-                    adjust_ease=self.config.get_config_param('adjust_ease'),
-                    tags=self.config.get_config_param('tags')
-                )
-                cards_added = creator.create_cards(terms, selected_lang)
-                log_info(f'[auto import] Total {cards_added} cards added to deck {selected_deck}\n'
-                         f'(ignored {len(terms)-cards_added} duplicates)')
-                showInfo(f'Total {cards_added} cards added to deck {selected_deck}\n'
-                         f'(ignored {len(terms)-cards_added} duplicates)')
-            else:
-                log_info('[auto_import] Auto-import completed: No new terms found.')
-        except Exception as e:
-            log_error(f'[auto_import] Auto-import failed: {str(e)}')
-            showInfo(f'Error when running auto_import {e}')
+    def run_import(self, col) -> OpChanges:
+        """ Imports new terms from LUTE, runs in a background thread """
+        engine = ImportEngine(self.config, col, 'auto').run()
+        if engine.error:
+            self.message = f'LUTE auto-import error: {engine.error}'
+        elif engine.processed:
+            self.message = (f'LUTE: {engine.added} cards added to deck {engine.deck}, '
+                            f'{engine.updated} updated<br>(ignored {engine.ignored} duplicates)')
+        else:
+            self.message = ''
+        return engine.changes or OpChanges()
@@ -0,0 +1,163 @@
+# generate_lute_db.py
+""" Generates synthetic lute.db files following LUTE's schema for benchmarking the importer
+
+Usage: python generate_lute_db.py --terms 10000 --output /tmp/bench/lute.db
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import sqlite3
+
+# Subset of LUTE's schema read by the importer, with LUTE's own indexes
+SCHEMA = """
+    CREATE TABLE languages (
+        LgID INTEGER NOT NULL,
+        LgName VARCHAR(40) NOT NULL,
+        LgCharacterSubstitutions VARCHAR(500) NOT NULL DEFAULT '',
+        LgRegexpSplitSentences VARCHAR(500) NOT NULL DEFAULT '',
+        LgRegexpWordCharacters VARCHAR(500) NOT NULL DEFAULT '',
+        LgRightToLeft TINYINT NOT NULL DEFAULT 0,
+        LgShowRomanization TINYINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (LgID)
+    );
+    CREATE TABLE words (
+        WoID INTEGER NOT NULL,
+        WoLgID INTEGER NOT NULL,
+        WoText VARCHAR(250) NOT NULL,
+        WoTextLC VARCHAR(250) NOT NULL,
+        WoStatus TINYINT NOT NULL,
+        WoTranslation VARCHAR(500) NULL,
+        WoRomanization VARCHAR(100) NULL,
+        WoTokenCount TINYINT NOT NULL DEFAULT 0,
+        WoCreated DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        WoStatusChanged DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        WoSyncStatus INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (WoID),
+        FOREIGN KEY (WoLgID) REFERENCES languages (LgID) ON DELETE CASCADE
+    );
+    CREATE UNIQUE INDEX WoTextLCLgID ON words (WoTextLC, WoLgID);
+    CREATE INDEX WoLgID ON words (WoLgID);
+    CREATE INDEX WoStatus ON words (WoStatus);
+    CREATE INDEX WoStatusChanged ON words (WoStatusChanged);
+    CREATE TABLE wordparents (
+        WpWoID INTEGER NOT NULL,
+        WpParentWoID INTEGER NOT NULL,
+        PRIMARY KEY (WpWoID, WpParentWoID),
+        FOREIGN KEY (WpWoID) REFERENCES words (WoID) ON DELETE CASCADE,
+        FOREIGN KEY (WpParentWoID) REFERENCES words (WoID) ON DELETE CASCADE
+    );
+    CREATE TABLE tags (
+        TgID INTEGER NOT NULL,
+        TgText VARCHAR(20) NOT NULL,
+        TgComment VARCHAR(200) NOT NULL DEFAULT '',
+        PRIMARY KEY (TgID)
+    );
+    CREATE UNIQUE INDEX TgText ON tags (TgText);
+    CREATE TABLE wordtags (
+        WtWoID INTEGER NOT NULL,
+        WtTgID INTEGER NOT NULL,
+        PRIMARY KEY (WtWoID, WtTgID),
+        FOREIGN KEY (WtWoID) REFERENCES words (WoID) ON DELETE CASCADE,
+        FOREIGN KEY (WtTgID) REFERENCES tags (TgID) ON DELETE CASCADE
+    );
+    CREATE INDEX WtTgID ON wordtags (WtTgID);
+    CREATE TABLE wordimages (
+        WiID INTEGER NOT NULL,
+        WiWoID INTEGER NOT NULL,
+        WiSource VARCHAR(500) NOT NULL,
+        PRIMARY KEY (WiID),
+        FOREIGN KEY (WiWoID) REFERENCES words (WoID) ON DELETE CASCADE
+    );
+    CREATE INDEX WiWoID ON wordimages (WiWoID);
+"""
+
+LANGUAGES = ['Spanish', 'German', 'French', 'Italian', 'Japanese']
+TAGS = ['noun', 'verb', 'adjective', 'adverb', 'idiom', 'false friend', 'slang', 'formal']
+# Distribution of LUTE statuses (0 unknown, 1-5 learning, 98 ignored, 99 well known)
+STATUSES = [0, 1, 1, 2, 2, 3, 3, 4, 5, 98, 99, 99]
+SYLLABLES = ['ka', 'lo', 'mi', 're', 'to', 'su', 'na', 'be', 'di', 'go', 'pa', 'ze', 'wu', 'xi']
+ZWS = '\u200B'
+# Rows inserted with one executemany call
+INSERT_BATCH = 10000
+
+
+def make_text(rng: random.Random, index: int) -> str:
+    """ Unique term text, a part of the terms are multi-word terms joined by zero width spaces """
+    word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) + str(index)
+    if rng.random() < 0.1:
+        word = f'{word}{ZWS} {ZWS}{rng.choice(SYLLABLES)}'
+    return word
+
+
+def generate(path: str, terms: int, languages: int = 2, seed: int = 1, days: int = 365,
+             parent_ratio: float = 0.2, tag_ratio: float = 0.3, image_ratio: float = 0.05):
+    """ Writes a lute.db file with the given number of terms spread over languages """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    conn.executemany('INSERT INTO languages (LgID, LgName) VALUES (?, ?)',
+                     [(i + 1, LANGUAGES[i % len(LANGUAGES)]) for i in range(languages)])
+    conn.executemany('INSERT INTO tags (TgID, TgText) VALUES (?, ?)',
+                     [(i + 1, tag) for i, tag in enumerate(TAGS)])
+
+    now = datetime(2025, 1, 1)
+    words, parents, word_tags, images = [], [], [], []
+    image_id = 0
+    for woid in range(1, terms + 1):
+        text = make_text(rng, woid)
+        created = now - timedelta(seconds=rng.randint(0, days * 24 * 3600))
+        changed = created + timedelta(seconds=rng.randint(0, 30 * 24 * 3600))
+        translation = rng.choice([None, '', f'translation of {text}',
+                                  f'first meaning\r\nsecond meaning of {text}'])
+        words.append((woid, 1 + woid % languages, text, text.lower(), rng.choice(STATUSES),
+                      translation, None, text.count(' ') + 1,
+                      created.strftime('%Y-%m-%d %H:%M:%S'), changed.strftime('%Y-%m-%d %H:%M:%S')))
+
+        # Parents always point to earlier terms of the same language
+        if woid > languages and rng.random() < parent_ratio:
+            steps = rng.randint(1, max(1, (woid - 1) // languages))
+            parents.append((woid, woid - languages * steps))
+        if rng.random() < tag_ratio:
+            for tag_id in rng.sample(range(1, len(TAGS) + 1), rng.randint(1, 3)):
+                word_tags.append((woid, tag_id))
+        if rng.random() < image_ratio:
+            image_id += 1
+            images.append((image_id, woid, f'{1 + woid % languages}/{text}.jpeg'))
+
+        if len(words) >= INSERT_BATCH:
+            flush(conn, words, parents, word_tags, images)
+
+    flush(conn, words, parents, word_tags, images)
+    conn.commit()
+    conn.close()
+
+
+def flush(conn: sqlite3.Connection, words: list, parents: list, word_tags: list, images: list):
+    """ Inserts collected rows and clears the lists """
+    conn.executemany('INSERT INTO words (WoID, WoLgID, WoText, WoTextLC, WoStatus, WoTranslation,'
+                     ' WoRomanization, WoTokenCount, WoCreated, WoStatusChanged)'
+                     ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', words)
+    conn.executemany('INSERT OR IGNORE INTO wordparents VALUES (?, ?)', parents)
+    conn.executemany('INSERT INTO wordtags VALUES (?, ?)', word_tags)
+    conn.executemany('INSERT INTO wordimages VALUES (?, ?, ?)', images)
+    for rows in (words, parents, word_tags, images):
+        rows.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic lute.db')
+    parser.add_argument('--terms', type=int, default=10000)
+    parser.add_argument('--languages', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='lute.db')
+    args = parser.parse_args()
+    generate(args.output, args.terms, args.languages, args.seed)
+    print(f'Generated {args.terms} terms into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# run_benchmarks.py
+""" Measures how reading lute.db and importing terms scale with the number of terms
+
+Runs outside of Anki against a temporary collection, needs the anki package
+(pip install anki). Results are written as JSON so runs can be compared with each other.
+
+Usage: python run_benchmarks.py --sizes 1000 10000 --output results/run.json
+"""
+import argparse
+from datetime import date, datetime
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from generate_lute_db import generate
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+# Importer settings used for all runs
+LANGUAGE_ID = 1
+CUTOFF_DATE = date(2000, 1, 1)
+
+
+def load_addon():
+    """ Imports database and note_creator with the package loader of the command line import """
+    sys.path.insert(0, ADDON_DIR)
+    from lute_import import load_addon as load_package
+    package = load_package()
+    database = importlib.import_module(f'{package.__name__}.database')
+    note_creator = importlib.import_module(f'{package.__name__}.note_creator')
+    return database, note_creator
+
+
+def measure(phase: str, results: dict, function, *args, **kwargs):
+    """ Runs function and stores its wall time and peak of allocated memory under phase """
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results[phase] = {'seconds': round(elapsed, 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+    print(f'  {phase:<14} {elapsed:9.3f} s {peak / 2 ** 20:9.1f} MB')
+    return value
+
+
+def run_size(size: int, work_dir: str, database, note_creator) -> dict:
+    """ Benchmarks all phases for a lute.db with size terms """
+    from anki.collection import Collection
+
+    results = {'terms': size}
+    db_path = os.path.join(work_dir, f'lute_{size}.db')
+    print(f'{size} terms')
+    generate(db_path, size, languages=1)
+
+    # query: streaming all matching terms from lute.db
+    db = database.LuteDatabase(db_path)
+    terms = measure('query', results, lambda: list(db.stream_terms(
+        False, False, False, CUTOFF_DATE, language_id=LANGUAGE_ID)))
+    results['rows'] = len(terms)
+
+    col = Collection(os.path.join(work_dir, f'collection_{size}.anki2'))
+    try:
+        def creator():
+            return note_creator.NoteCreator('Basic', 'Default', False, True, False, [],
+                                            source=db_path, col=col)
+
+        # insert: first import, every term becomes a new note
+        first = creator()
+        results['added'] = measure('insert', results, first.create_cards, terms, LANGUAGE_ID)
+
+        # dedupe: building the duplicate index from the notes added above
+        measure('dedupe', results, creator().build_duplicate_index)
+
+        # rerun: second import, every term is already linked to a note
+        rerun = creator()
+        measure('rerun', results, rerun.create_cards, terms, LANGUAGE_ID)
+        if first.error or rerun.error:
+            results['error'] = first.error or rerun.error
+    finally:
+        col.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the LUTE to Anki importer')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--output', help='JSON file for results (default: results/<time>.json)')
+    args = parser.parse_args()
+
+    database, note_creator = load_addon()
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+
+    runs = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            runs.append(run_size(size, work_dir, database, note_creator))
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': runs,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# cli.py
+""" Imports LUTE terms into an Anki collection file from the command line
+
+Runs the same import as auto-import, with the settings of the add-on's config.json (or
+--config), against a collection that is not open in Anki. Started by lute_import.py.
+"""
+import argparse
+import sys
+from typing import List, Optional
+from .config import Config
+from .engine import ImportEngine
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Import LUTE terms into an Anki collection')
+    parser.add_argument('collection', help='collection file of the profile (collection.anki2)')
+    parser.add_argument('--config', help="settings file (default: the add-on's config.json)")
+    parser.add_argument('--lute-db', help='lute.db to import from instead of the configured one')
+    parser.add_argument('--full-resync', action='store_true',
+                        help='read all terms matching the filters, not only new ones')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ Runs one import, returns the exit code (1 when the import failed) """
+    args = parse_args(argv)
+    # anki (pip install anki) is only needed here, the GUI uses the collection of Anki
+    from anki.collection import Collection
+
+    config = Config(args.config)
+    col = Collection(args.collection)
+    try:
+        engine = ImportEngine(config, col, 'cli', db_path=args.lute_db,
+                              full_resync=args.full_resync)
+        engine.run(progress_callback=lambda processed, added: print(
+            f'Read {processed} terms, {added} notes added', end='\r', file=sys.stderr))
+        if engine.processed:
+            # Ends the progress line
+            print(file=sys.stderr)
+    finally:
+        col.close()
+        # Sync cursors of a completed import are saved right away, not by the flush timer
+        config.flush()
+
+    if engine.error:
+        print(f'LUTE import error: {engine.error}', file=sys.stderr)
+        return 1
+    print(f'{engine.added} cards added to deck {engine.deck}, {engine.updated} updated '
+          f'(ignored {engine.ignored} duplicates)')
+    return 0
@@ -1,8 +1,10 @@
 # config.py
+import atexit
 import json
 import os
-from typing import Any, Dict
-from aqt import mw
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 from .logger import log_error, log_info
 
 defaults = {
@@ -10,6 +12,7 @@ defaults = {
     'parents_only': False,
     'empty_translation': False,
     'allow_duplicates': False,
+    'update_existing': False,
     'import_tags': False,
     'selected_deck': "Default",
     'selected_model': 'Basic',
@@ -18,60 +21,246 @@ defaults = {
     'selected_lang': 0,
     'last_days': 0,
     'tags': [],
-    'auto_import': False
+    'auto_import': False,
+    'full_resync': False,
+    'snapshot_db': False,
+    'auto_import_interval': 0,
+    'sync_cursors': {},
+    'route_languages': False,
+    'language_routes': {},
+    'import_images': False,
+    'lute_sources': [],
+    'well_known_cards': ''
+}
+
+# Seconds without further updates after which config changes are written to disk
+FLUSH_DELAY = 1.0
+# Settings of a lute.db source (in lute_sources) and the main settings they default to
+SOURCE_SETTINGS = {
+    'path': 'lutedb_path',
+    'language_id': 'selected_lang',
+    'deck': 'selected_deck',
+    'model': 'selected_model',
+    'tags': 'tags',
+    'parents_only': 'parents_only',
+    'empty_translation': 'empty_translation',
+    'include_WKI': 'include_WKI',
+    'last_days': 'last_days'
 }
 
 
 class Config:
-    def __init__(self):
-        """ Initializing addon directory and ID """
+    # Config is shared by all instances, reloaded only when config.json changes on disk
+    cache: Optional[Dict[str, Any]] = None
+    cache_mtime: Optional[float] = None
+    cache_path: Optional[str] = None
+    # Pending writes are coalesced and flushed once after FLUSH_DELAY seconds
+    dirty = False
+    flush_timer: Optional[threading.Timer] = None
+    lock = threading.RLock()
+
+    def __init__(self, config_path: Optional[str] = None):
+        """ Initializing addon directory and ID, config_path replaces the add-on's config.json """
         global defaults
         self.addon_dir = os.path.dirname(os.path.abspath(__file__))
         self.addon_id = os.path.basename(self.addon_dir)
         self.default_config = defaults
+        self.addon_config_path = os.path.join(self.addon_dir, 'config.json')
+        self.config_path = os.path.abspath(config_path or self.addon_config_path)
+
+    def get_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
 
     # Get exisiting config or use the default one
     def get_config(self) -> Dict[str, Any]:
-        """Get current config directly from config.json"""
-        config_path = os.path.join(self.addon_dir, 'config.json')
-        try:
-            with open(config_path, 'r') as file:
-                config = json.load(file)
-                log_info('Configuration loaded succesfully')
-        except (FileNotFoundError, json.JSONDecodeError):
-            # Fallback to default config if file not found or invalid
-            global defaults
-            config = defaults
-        return config
+        """Get current config, read from config.json only when the file has changed"""
+        with Config.lock:
+            mtime = self.get_mtime()
+            # Unflushed changes are newer than the file, so the file is not re-read meanwhile
+            if Config.cache is None or Config.cache_path != self.config_path or (
+                    not Config.dirty and mtime != Config.cache_mtime):
+                try:
+                    with open(self.config_path, 'r') as file:
+                        Config.cache = json.load(file)
+                        log_info('Configuration loaded succesfully')
+                except (FileNotFoundError, json.JSONDecodeError):
+                    # Fallback to default config if file not found or invalid
+                    global defaults
+                    Config.cache = dict(defaults)
+                Config.cache_mtime = mtime
+                Config.cache_path = self.config_path
+            return Config.cache
 
     def update_config(self, updates: dict) -> bool:
         """ Update config with new values while preserving existing ones """
         try:
-            # Get current config
-            current_config = self.get_config()
+            with Config.lock:
+                # Update cached config with new values
+                self.get_config().update(updates)
 
-            # Update with new values
-            current_config.update(updates)
+                # Save updated config once no further updates arrive for FLUSH_DELAY
+                Config.dirty = True
+                if Config.flush_timer is not None:
+                    Config.flush_timer.cancel()
+                Config.flush_timer = threading.Timer(FLUSH_DELAY, self.flush)
+                Config.flush_timer.daemon = True
+                Config.flush_timer.start()
+            return True
+        except Exception as e:
+            log_error('[config] Configuration update failed: %s', e)
+            return False
 
-            # Save updated config
-            config_path = os.path.join(self.addon_dir, 'config.json')
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(current_config, f, indent=4)
+    def flush(self) -> bool:
+        """ Writes pending changes atomically to config.json and Anki's add-on config """
+        try:
+            with Config.lock:
+                if Config.flush_timer is not None:
+                    Config.flush_timer.cancel()
+                    Config.flush_timer = None
+                if not Config.dirty:
+                    return True
 
-            # Update Anki's config
-            mw.addonManager.writeConfig(self.addon_id, current_config)
+                # Save updated config into temporary file replacing config.json at once,
+                # the file the cache was read from (flush at exit uses the default path)
+                config_path = Config.cache_path or self.config_path
+                current_config = dict(Config.cache)
+                handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(config_path),
+                                                     suffix='.tmp')
+                try:
+                    with os.fdopen(handle, 'w', encoding='utf-8') as f:
+                        json.dump(current_config, f, indent=4)
+                    os.replace(temp_path, config_path)
+                except Exception:
+                    os.remove(temp_path)
+                    raise
+                Config.cache_mtime = os.stat(config_path).st_mtime
+                Config.dirty = False
 
+            # Update Anki's config, unless running outside of Anki (command line)
+            if config_path == self.addon_config_path:
+                self.write_addon_config(current_config)
             return True
         except Exception as e:
-            log_error(f'[config] Configuration update failed: {str(e)}')
+            log_error('[config] Configuration update failed: %s', e)
             return False
 
+    def write_addon_config(self, current_config: Dict[str, Any]):
+        try:
+            from aqt import mw
+        except ImportError:
+            return
+        if mw is not None:
+            mw.addonManager.writeConfig(self.addon_id, current_config)
+
     def get_config_param(self, param: str):
-        """ Loading parameters from config.json file """
+        """ Loading parameters from cached config """
         try:
             conf = self.get_config()
             return conf.get(param)
         except Exception as e:
             global defaults
-            log_error(f'[config] Requested parameter {param} not found, using default: {str(e)}')
+            log_error('[config] Requested parameter %s not found, using default: %s', param, e)
             return defaults.get(param)  # Returns the default value for the param
+
+    @staticmethod
+    def sync_cursor_key(collection_path: str, db_path: str, language_id) -> str:
+        """ Sync cursors are stored per collection, LUTE database file and language """
+        # Add-on config is shared by all profiles, each imports into its own collection
+        return f'{os.path.abspath(collection_path)}|{os.path.abspath(db_path)}|{language_id}'
+
+    def get_sync_cursor(self, collection_path: str, db_path: str,
+                        language_id) -> Optional[Dict[str, Any]]:
+        """ Returns the last import mark for database and language, None if not imported yet """
+        cursors = self.get_config_param('sync_cursors') or {}
+        return cursors.get(self.sync_cursor_key(collection_path, db_path, language_id))
+
+    def set_sync_cursors(self, collection_path: str, db_path: str,
+                         marks: Dict[Any, Optional[Dict[str, Any]]]) -> bool:
+        """ Saves the last import marks of several languages with a single config update """
+        if not any(marks.values()):
+            return False
+        cursors = dict(self.get_config_param('sync_cursors') or {})
+        for language_id, cursor in marks.items():
+            if cursor:
+                cursors[self.sync_cursor_key(collection_path, db_path, language_id)] = cursor
+        log_info('[config] Sync cursors for %s set to %s', db_path, marks)
+        return self.update_config({'sync_cursors': cursors})
+
+    def get_language_routes(self) -> Dict[int, Dict[str, Any]]:
+        """ Returns {LgID: {'deck', 'model', 'tags'}} of languages imported in one pass """
+        routes = self.get_config_param('language_routes') or {}
+        # Missing deck or note type falls back to the ones selected in the window
+        fallback = {'deck': self.get_config_param('selected_deck'),
+                    'model': self.get_config_param('selected_model'),
+                    'tags': []}
+        # JSON object keys are strings, LgID read from lute.db is an integer
+        return {int(language_id): {**fallback, **route} for language_id, route in routes.items()}
+
+    def get_import_scope(self, collection_path: str, db_path: str, full_resync: bool = False
+                         ) -> Tuple[Dict[int, Dict[str, Any]], Dict[str, Any]]:
+        """ Returns routes (empty unless enabled) and language arguments for reading terms """
+        # Terms are read from the sync cursors of the languages unless full resync is set
+        full_resync = full_resync or self.get_config_param('full_resync')
+        routes = self.get_language_routes() if self.get_config_param('route_languages') else {}
+        if routes:
+            # All routed languages are read in a single scan, each from its own sync cursor
+            cursors = {} if full_resync else {
+                language_id: self.get_sync_cursor(collection_path, db_path, language_id)
+                for language_id in routes}
+            return routes, {'language_ids': list(routes), 'sync_cursors': cursors}
+
+        selected_lang = self.get_config_param('selected_lang')
+        cursor = None if full_resync else self.get_sync_cursor(collection_path, db_path,
+                                                               selected_lang)
+        return routes, {'language_id': selected_lang or None, 'sync_cursor': cursor}
+
+    def get_lute_sources(self, collection_path: str, db_path: Optional[str] = None,
+                         full_resync: bool = False) -> List[Dict[str, Any]]:
+        """ Returns the main lute.db and the ones in lute_sources with their routes and filters """
+        main = {setting: self.get_config_param(param) for setting, param in SOURCE_SETTINGS.items()}
+        if db_path:
+            main['path'] = db_path
+        main_routes = self.get_language_routes() if self.get_config_param('route_languages') else {}
+        full_resync = full_resync or self.get_config_param('full_resync')
+
+        sources = []
+        paths = set()
+        for settings in [main] + list(self.get_config_param('lute_sources') or []):
+            # Settings missing in an additional source are the ones of the main lute.db
+            source = {**main, **settings}
+            path = os.path.abspath(source['path'])
+            if path in paths:
+                log_error('[config] lute.db %s is listed more than once, ignored', path)
+                continue
+            paths.add(path)
+
+            fallback = {'deck': source['deck'], 'model': source['model'],
+                        'tags': list(source['tags'] or [])}
+            if settings is main and main_routes:
+                routes = main_routes
+            elif settings.get('routes'):
+                routes = {int(language_id): {**fallback, **route}
+                          for language_id, route in settings['routes'].items()}
+            else:
+                routes = {int(source['language_id']): fallback}
+            source['routes'] = routes
+            # Every language of every file is read from its own sync cursor
+            source['sync_cursors'] = {} if full_resync else {
+                language_id: self.get_sync_cursor(collection_path, source['path'], language_id)
+                for language_id in routes}
+            sources.append(source)
+        return sources
+
+    def set_language_route(self, language_id, deck: str, model: str, tags: List[str]) -> bool:
+        """ Routes terms of a language to a deck and note type with additional tags """
+        routes = dict(self.get_config_param('language_routes') or {})
+        routes[str(language_id)] = {'deck': deck, 'model': model, 'tags': list(tags)}
+        log_info('[config] Language %s routed to deck %s (%s)', language_id, deck, model)
+        return self.update_config({'language_routes': routes})
+
+
+# Writing changes still waiting for the flush timer when Anki exits
+atexit.register(lambda: Config().flush())
@@ -1,48 +1,150 @@
 # database.py
 from datetime import date
+from functools import lru_cache
+import os
+from pathlib import Path
 import sqlite3
-from typing import List, Tuple
-from aqt.utils import showInfo
-from .logger import log_error, log_info
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, TypeVar
+from .logger import log_error, log_info, log_warning
+from .metrics import RunMetrics
+from .note_map import NoteMap
+from .term import LuteTerm
+
+T = TypeVar('T')
+
+# Columns projected for every LuteTerm field, in the order of its slots
+TERM_COLUMNS = {
+    'text': 'w.WoText',
+    'translation': 'w.WoTranslation',
+    'language_id': 'w.WoLgID',
+    'woid': 'w.WoID',
+    'status': 'w.WoStatus',
+    'created': 'w.WoCreated',
+    'status_changed': 'w.WoStatusChanged',
+    # All tags of the term (spaces replaced, as Anki tags are space separated)
+    'tags': """(SELECT GROUP_CONCAT(REPLACE(t.TgText, ' ', '_'), ' ')
+                     FROM wordtags AS wt
+                     JOIN tags AS t ON wt.WtTgID = t.TgID
+                     WHERE wt.WtWoID = w.WoID)""",
+    'image': """(SELECT wi.WiSource
+                      FROM wordimages AS wi
+                      WHERE wi.WiWoID = w.WoID
+                      LIMIT 1)"""
+}
+# Fields only projected when the import uses them, NULL otherwise
+OPTIONAL_FIELDS = ('tags', 'image')
+# Number of rows read from lute.db at once when streaming terms
+FETCH_SIZE = 500
+# Seconds sqlite waits for a lock held by the running LUTE server before giving up
+BUSY_TIMEOUT = 5.0
+# Attempts and initial delay (in seconds, doubled after each attempt) for locked database
+LOCK_RETRIES = 4
+LOCK_RETRY_DELAY = 0.5
 
 
 class LuteDatabase:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, use_snapshot: bool = False,
+                 metrics: Optional[RunMetrics] = None, note_map_path: Optional[str] = None):
         self.db_path = db_path
+        self.use_snapshot = use_snapshot
+        # Timings and counters of the import run this database is read for
+        self.metrics = metrics or RunMetrics('database')
+        # NoteMap store of the collection terms are imported into, sync cursors only skip
+        # terms linked to a note in it; without it, sync cursors are not applied
+        self.note_map_path = note_map_path
+        self.links_loaded = False
+        self.snapshot_path = None
+        # Sync marks of all languages read, {LgID: mark}
+        self.sync_marks = {}
+        self.rows_read = 0
 
     def build_sql_query(self, parents_only=False, empty_translation=False, include_WKI=False,
-                        cutoff_date=date.today(), include_unknown=False):
-        """ Define SQL query for loading terms which should be passed to Anki """
-        # SELECT query to load information from lute.db (not all fields are used)
-        if parents_only:
-            base_query = """
-                SELECT DISTINCT
-                    WoText, WoTranslation, WoLgID, WoCreated, TgText,
-                    WoStatusChanged, WoTextLC, WoID, WoStatus, WoRomanization,
-                    WiSource, TgComment, WpParentWoID
-                FROM wordparents AS wp
-                LEFT JOIN words AS w ON wp.WpParentWoID = w.WoID
-                LEFT JOIN wordimages AS wi ON w.WoID = wi.WiWoID
-                LEFT JOIN wordtags AS wt ON wi.WiWoID = wt.WtWoID
-                LEFT JOIN tags AS t ON wt.WtTgID = t.TgID
-            """
-        else:
-            base_query = """
-                SELECT WoText, WoTranslation, WoLgID, WoCreated, TgText,
-                    WoStatusChanged, WoTextLC, WoID, WoStatus, WoRomanization,
-                    WiSource, TgComment
+                        cutoff_date: Optional[date] = None, include_unknown=False,
+                        sync_cursor: Optional[Dict[str, Any]] = None,
+                        language_id=None, language_ids: Optional[Sequence] = None,
+                        sync_cursors: Optional[Dict[Any, Dict[str, Any]]] = None,
+                        include_tags=True, include_image=True) -> Tuple[str, List]:
+        """ Define SQL query and its bound parameters for loading terms passed to Anki """
+        # Values are always bound as parameters, so the statement text only depends on
+        # which filters are active and is reused by sqlite's statement cache across runs
+        cutoff_date = cutoff_date or date.today()
+        language_ids, sync_cursors = self.language_scope(language_id, sync_cursor,
+                                                         language_ids, sync_cursors)
+        language_cursors = tuple(bool(sync_cursors.get(lang)) and self.links_loaded
+                                 for lang in language_ids)
+        query = self.query_text(parents_only, empty_translation, include_WKI, include_unknown,
+                                language_cursors, include_tags, include_image)
+
+        # WoCreated is stored as 'YYYY-MM-DD HH:MM:SS', so the cutoff is bound in the same
+        # format and compared directly with the column (no date() call hiding it from indexes)
+        params = [cutoff_date.strftime('%Y-%m-%d 00:00:00')]
+        for lang in language_ids:
+            params.append(lang)
+            cursor = sync_cursors.get(lang)
+            if cursor and self.links_loaded:
+                last_changed = cursor.get('last_changed', '')
+                params.extend([int(cursor.get('max_woid', 0)), last_changed, last_changed])
+
+        log_info('[database] Executing SQL query to fetch terms.')
+        return query, params
+
+    @staticmethod
+    def language_scope(language_id=None, sync_cursor: Optional[Dict[str, Any]] = None,
+                       language_ids: Optional[Sequence] = None,
+                       sync_cursors: Optional[Dict[Any, Dict[str, Any]]] = None
+                       ) -> Tuple[List, Dict[Any, Dict[str, Any]]]:
+        """ Returns languages to read and their sync cursors, for one or several languages """
+        if language_ids is None:
+            if language_id is None:
+                return [], {}
+            return [language_id], ({language_id: sync_cursor} if sync_cursor else {})
+        return list(language_ids), dict(sync_cursors or {})
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def query_text(parents_only: bool, empty_translation: bool, include_WKI: bool,
+                   include_unknown: bool, language_cursors: Tuple[bool, ...] = (),
+                   include_tags: bool = True, include_image: bool = True) -> str:
+        """ Builds the SQL statement text for a combination of active filters """
+        # Only columns of LuteTerm fields are projected, in the order of its slots.
+        # Tags and image are read with correlated subqueries, so every term is exactly one
+        # row, and are skipped entirely (NULL) when the import does not use them
+        skipped = {field for field, used in zip(OPTIONAL_FIELDS, (include_tags, include_image))
+                   if not used}
+        columns = ',\n                    '.join(
+            'NULL' if field in skipped else expression
+            for field, expression in TERM_COLUMNS.items())
+        base_query = f"""
+                SELECT
+                    {columns}
                 FROM words AS w
-                LEFT JOIN wordimages AS wi ON w.WoID = wi.WiWoID
-                LEFT JOIN wordtags AS wt ON wi.WiWoID = wt.WtWoID
-                LEFT JOIN tags AS t ON wt.WtTgID = t.TgID
             """
         # Create list of conditions to use as filter
         where_conditions = ['WoTranslation IS NOT NULL',
-                            f'WoCreated >= \"{cutoff_date.isoformat()}\"']
+                            'WoCreated >= ?']
+
+        # Only terms that are a parent of another term, as a semi-join on parent ids so every
+        # parent is read once without joining its children and removing duplicates
+        if parents_only:
+            where_conditions.append('w.WoID IN (SELECT WpParentWoID FROM wordparents)')
+
+        # Filter out terms of other languages directly in SQLite, language_cursors holds
+        # one flag per language read, set when terms linked to a note are only read again
+        # when added or changed since the last import of the language (sync cursor).
+        # Terms without a note (e.g. translated in LUTE only later) are always read
+        if language_cursors:
+            language_filters = [
+                '(WoLgID = ? AND (WoID > ? OR WoCreated > ? OR WoStatusChanged > ?'
+                ' OR w.WoID NOT IN (SELECT woid FROM linked_terms)))'
+                if use_cursor else 'WoLgID = ?'
+                for use_cursor in language_cursors]
+            where_conditions.append('(' + ' OR '.join(language_filters) + ')')
 
         # Filter out terms with blank translations
         if not empty_translation:
-            where_conditions.append('WoTranslation <> ""')
+            where_conditions.append("WoTranslation <> ''")
 
         # Filter out terms with statuses 98, 99
         if not include_WKI:
@@ -54,41 +156,177 @@ class LuteDatabase:
 
         # Join all conditions with 'AND'
         where_clause = 'WHERE ' + ' AND '.join(where_conditions)
-        log_info('[database] Executing SQL query to fetch terms.')
-
         return f'{base_query}\n{where_clause};'
 
-    def connect(self, parents_only, empty_translation,
-                include_WKI, cutoff_date) -> Tuple[List, List]:
-        """ Connect to LUTE database and retrieve terms and languages """
+    def is_lute_db(self) -> bool:
+        """ Checks if file other than lute.db has been selected """
         if not self.db_path.endswith('lute.db'):
-            # Checks if file other than lute.db has been selected
-            showInfo('Please select a lute.db file')
-            log_error(f'[database] Invalid database file selected: {self.db_path}')
-            return [], []
+            log_error('[database] Invalid database file selected: %s', self.db_path)
+            return False
+        return True
 
+    @staticmethod
+    def connect_read_only(path: str) -> sqlite3.Connection:
+        """ Opens database file read-only, waiting up to BUSY_TIMEOUT for locks """
+        uri = f'{Path(path).resolve().as_uri()}?mode=ro'
+        return sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT)
+
+    @staticmethod
+    def with_retry(operation: Callable[[], T]) -> T:
+        """ Runs operation again with growing delay while lute.db is locked by LUTE """
+        delay = LOCK_RETRY_DELAY
+        for attempt in range(1, LOCK_RETRIES + 1):
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                message = str(e).lower()
+                if attempt == LOCK_RETRIES or ('locked' not in message and 'busy' not in message):
+                    raise
+                log_warning('[database] Database is locked (attempt %d), retrying in %ss',
+                            attempt, delay)
+                time.sleep(delay)
+                delay *= 2
+
+    def take_snapshot(self) -> str:
+        """ Copies lute.db with sqlite's online backup API into a temporary file """
+        handle, snapshot_path = tempfile.mkstemp(prefix='lute_snapshot_', suffix='.db')
+        os.close(handle)
+        source = self.connect_read_only(self.db_path)
+        target = sqlite3.connect(snapshot_path)
         try:
-            # Connecting to lute.db
-            conn = sqlite3.connect(self.db_path)
-            log_info(f'[database] Successfully connected to database: {self.db_path}')
-            cursor = conn.cursor()
+            self.with_retry(lambda: source.backup(target))
+        except Exception:
+            target.close()
+            os.remove(snapshot_path)
+            raise
+        finally:
+            source.close()
+        target.close()
+        log_info('[database] Snapshot of %s taken into %s', self.db_path, snapshot_path)
+        return snapshot_path
+
+    def release_snapshot(self):
+        """ Removes the temporary snapshot after reading from it has finished """
+        if self.snapshot_path:
+            try:
+                os.remove(self.snapshot_path)
+            except OSError as e:
+                log_warning('[database] Could not remove snapshot %s: %s', self.snapshot_path, e)
+            self.snapshot_path = None
 
-            # Get terms (dynamic query based on filters)
-            cursor.execute(self.build_sql_query(parents_only, empty_translation,
-                                                include_WKI, cutoff_date))
-            terms = cursor.fetchall()
+    def open_connection(self) -> sqlite3.Connection:
+        """ Opens a read-only connection to lute.db, or to its snapshot when enabled """
+        # Read-only access waits for writes of a running LUTE server instead of failing,
+        # a snapshot releases lute.db right after it is copied
+        path = self.db_path
+        if self.use_snapshot:
+            if not self.snapshot_path:
+                with self.metrics.span('snapshot'):
+                    self.snapshot_path = self.take_snapshot()
+            path = self.snapshot_path
+        conn = self.connect_read_only(path)
+        log_info('[database] Successfully connected to database: %s', path)
+        if self.note_map_path:
+            self.load_links(conn)
+        return conn
 
-            # Get languages (pair used language IDs with language names)
-            used_lg_ids = list(set(term[2] for term in terms))
-            cursor.execute('SELECT * FROM languages')
-            all_languages = cursor.fetchall()
-            languages = [[lang[0], lang[1]] for lang in all_languages if lang[0] in used_lg_ids]
+    def load_links(self, conn: sqlite3.Connection):
+        """ Copies WoIDs of terms linked to notes into a temporary table of the connection """
+        # Copied instead of attached, so reading terms holds no lock on the store while
+        # links of the imported notes are written to it
+        woids = NoteMap.load_linked_woids(self.note_map_path, self.db_path)
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS linked_terms (woid INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT OR IGNORE INTO linked_terms (woid) VALUES (?)',
+                         ((woid,) for woid in woids))
+        self.links_loaded = True
 
+    @staticmethod
+    def get_languages(cursor: sqlite3.Cursor) -> List:
+        """ Returns [LgID, LgName] pairs of languages having any terms """
+        # Independent of filters and sync cursor, so the language stays selectable
+        # even when it has no new terms
+        LuteDatabase.with_retry(lambda: cursor.execute(
+            'SELECT LgID, LgName FROM languages'
+            ' WHERE LgID IN (SELECT DISTINCT WoLgID FROM words)'))
+        return [[lang[0], lang[1]] for lang in cursor.fetchall()]
+
+    def read_term_index(self) -> Tuple[List[Tuple], List, Set[int]]:
+        """ Reads filter columns of all terms, the languages and the ids of parent terms """
+        query = ("SELECT WoID, WoLgID, WoCreated, WoStatusChanged, WoStatus, WoTranslation <> ''"
+                 ' FROM words WHERE WoTranslation IS NOT NULL')
+        conn = self.open_connection()
+        try:
+            cursor = conn.cursor()
+            with self.metrics.span('query'):
+                self.with_retry(lambda: cursor.execute(query))
+                rows = cursor.fetchall()
+                self.with_retry(lambda: cursor.execute(
+                    'SELECT DISTINCT WpParentWoID FROM wordparents'))
+                parent_ids = {row[0] for row in cursor.fetchall()}
+                languages = self.get_languages(cursor)
+        finally:
             conn.close()
-            log_info(f'[database] Retrieved {len(terms)} terms and {len(languages)} languages.')
-            return terms, languages
+            self.release_snapshot()
+        log_info('[database] Read index of %d terms', len(rows))
+        return rows, languages, parent_ids
+
+    def stream_terms(self, parents_only, empty_translation, include_WKI, cutoff_date,
+                     sync_cursor: Optional[Dict[str, Any]] = None,
+                     language_id=None, language_ids: Optional[Sequence] = None,
+                     sync_cursors: Optional[Dict[Any, Dict[str, Any]]] = None,
+                     include_tags=True, include_image=True) -> Iterator[LuteTerm]:
+        """ Yields terms read from lute.db in chunks of FETCH_SIZE rows """
+        # Sync marks of terms read so far, available after the stream is consumed
+        tracked, self.sync_marks = self.language_scope(language_id, sync_cursor,
+                                                       language_ids, sync_cursors)
+        self.rows_read = 0
+        try:
+            conn = self.open_connection()
+        except Exception:
+            self.release_snapshot()
+            raise
+        try:
+            cursor = conn.cursor()
+            # Rows are built directly as compact LuteTerm records
+            cursor.row_factory = LuteTerm.from_row
+            query, params = self.build_sql_query(parents_only, empty_translation,
+                                                 include_WKI, cutoff_date,
+                                                 sync_cursor=sync_cursor, language_id=language_id,
+                                                 language_ids=language_ids,
+                                                 sync_cursors=sync_cursors,
+                                                 include_tags=include_tags,
+                                                 include_image=include_image)
+            # Only time spent in sqlite is measured, not the consumer of the stream
+            with self.metrics.span('query'):
+                self.with_retry(lambda: cursor.execute(query, params))
+            while True:
+                with self.metrics.span('query'):
+                    chunk = cursor.fetchmany(FETCH_SIZE)
+                if not chunk:
+                    break
+                self.rows_read += len(chunk)
+                self.metrics.count('rows_fetched', len(chunk))
+                for lang in tracked:
+                    self.sync_marks[lang] = self.get_sync_mark(chunk, lang,
+                                                               self.sync_marks.get(lang))
+                yield from chunk
+        finally:
+            conn.close()
+            self.release_snapshot()
+            log_info('[database] Streamed %d terms.', self.rows_read)
+
+    @staticmethod
+    def get_sync_mark(terms: List[LuteTerm], language_id,
+                      previous: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """ Returns the highest WoID and latest WoCreated/WoStatusChanged seen for a language """
+        max_woid = previous.get('max_woid', 0) if previous else 0
+        last_changed = previous.get('last_changed', '') if previous else ''
+        for term in terms:
+            if term.language_id != language_id:
+                continue
+            max_woid = max(max_woid, term.woid)
+            last_changed = max(last_changed, term.created or '', term.status_changed or '')
 
-        except Exception as e:
-            log_error(f'[database] Database connection error: {str(e)}')
-            showInfo(f'Database connection error: {str(e)}')
-            return [], []
+        if not max_woid:
+            return previous
+        return {'max_woid': max_woid, 'last_changed': last_changed}
@@ -0,0 +1,80 @@
+# diagnostics.py
+from datetime import date, datetime
+from itertools import product
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+from .database import FETCH_SIZE, LuteDatabase
+from .logger import log_info, log_warning
+
+DIAGNOSTICS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'query_diagnostics.json')
+# Filters combined into the query variants that are diagnosed
+VARIANT_FILTERS = ('parents_only', 'empty_translation', 'include_WKI')
+
+
+def diagnose_queries(db: LuteDatabase, cutoff_date: date, language_id=None,
+                     sync_cursor: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """ Runs every query variant against lute.db, recording its plan, rows and time """
+    results = []
+    conn = db.open_connection()
+    try:
+        cursor = conn.cursor()
+        for values in product((False, True), repeat=len(VARIANT_FILTERS)):
+            filters = dict(zip(VARIANT_FILTERS, values))
+            query, params = db.build_sql_query(cutoff_date=cutoff_date, sync_cursor=sync_cursor,
+                                               language_id=language_id, **filters)
+            db.with_retry(lambda: cursor.execute(f'EXPLAIN QUERY PLAN {query}', params))
+            # Rows are (id, parent, unused, detail), detail is e.g. 'SCAN w'
+            plan = [row[3] for row in cursor.fetchall()]
+
+            start = time.perf_counter()
+            db.with_retry(lambda: cursor.execute(query, params))
+            rows = 0
+            while True:
+                chunk = cursor.fetchmany(FETCH_SIZE)
+                if not chunk:
+                    break
+                rows += len(chunk)
+            elapsed = time.perf_counter() - start
+
+            results.append({
+                'filters': filters,
+                'rows': rows,
+                'seconds': round(elapsed, 4),
+                # Tables read completely instead of through an index
+                'scans': [step.split()[1] for step in plan if step.startswith('SCAN')],
+                'plan': plan
+            })
+    finally:
+        conn.close()
+        db.release_snapshot()
+
+    log_info('[diagnostics] Diagnosed %d query variants of %s', len(results), db.db_path)
+    save_report(db.db_path, results)
+    return results
+
+
+def save_report(db_path: str, results: List[Dict[str, Any]], path: str = DIAGNOSTICS_FILE):
+    """ Keeps the last diagnostics so they can be attached to bug reports """
+    report = {'created': datetime.now().isoformat(timespec='seconds'),
+              'database': db_path,
+              'variants': results}
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        log_warning('[diagnostics] Could not write query diagnostics: %s', e)
+
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    """ One readable block per query variant """
+    blocks = []
+    for result in results:
+        filters = ', '.join(name for name, value in result['filters'].items() if value)
+        scan = f'  (full scan of {", ".join(result["scans"])})' if result['scans'] else ''
+        plan = '\n'.join(f'    {step}' for step in result['plan'])
+        blocks.append(f'{filters or "no filters"}: {result["rows"]} rows in '
+                      f'{result["seconds"]:.3f}s{scan}\n{plan}')
+    return '\n\n'.join(blocks)
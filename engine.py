@@ -0,0 +1,296 @@
+# engine.py
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, timedelta
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from .config import Config
+from .database import LuteDatabase
+from .logger import log_debug, log_error, log_info
+from .media import MediaImporter
+from .metrics import RunHistory, RunMetrics
+from .note_creator import BATCH_SIZE, NoteCreator
+from .note_map import NoteMap
+from .router import LanguageRouter
+from .term import LuteTerm
+
+# Number of lute.db files read at the same time
+SOURCE_WORKERS = 4
+# Chunks of terms read ahead per lute.db, bounds the terms held in memory while notes are written
+READ_AHEAD_CHUNKS = 4
+
+
+class ImportEngine:
+    """ Imports LUTE terms into a collection with the saved settings, without Anki's window """
+
+    def __init__(self, config: Config, col, trigger: str = 'auto', db_path: Optional[str] = None,
+                 full_resync: bool = False):
+        self.config = config
+        # Collection notes are added to, the open profile's or one opened from a file
+        self.col = col
+        # lute.db and full resync given for this run only, instead of the saved settings
+        self.db_path = db_path
+        self.full_resync = full_resync
+        self.metrics = RunMetrics(trigger)
+        self.status = 'failed'
+        self.deck = ''
+        self.added = 0
+        self.updated = 0
+        self.ignored = 0
+        self.processed = 0
+        self.error = None
+        # Undo changes of the import (OpChanges), None when nothing was written
+        self.changes = None
+
+    def run(self, progress_callback: Optional[Callable[[int, int], None]] = None,
+            should_cancel: Optional[Callable[[], bool]] = None) -> 'ImportEngine':
+        """ Imports terms added or changed in LUTE since the last import """
+        try:
+            if self.config.get_config_param('lute_sources'):
+                return self.run_sources(progress_callback, should_cancel)
+
+            db_path = self.db_path or self.config.get_config_param('lutedb_path')
+            log_debug('[engine] Loaded db path: %s', db_path)
+            if db_path == 'Open file manager' or not db_path.endswith('lute.db'):
+                log_error('[engine] Import failed: LUTE database path is not set.')
+                self.error = 'No lute.db file selected'
+                return self
+
+            log_info('[engine] Starting import from LUTE database.')
+            db = LuteDatabase(db_path, self.config.get_config_param('snapshot_db'), self.metrics,
+                              NoteMap.path_for_collection(self.col))
+            # Reading only terms not imported yet or changed since the last import unless full
+            # resync is set, of all routed languages at once when language routing is enabled
+            routes, language_scope = self.config.get_import_scope(self.col.path, db_path,
+                                                                  self.full_resync)
+            media = None
+            if self.config.get_config_param('import_images'):
+                media = MediaImporter(db_path, self.col, self.metrics)
+
+            # Terms are streamed from lute.db straight into note creation
+            terms = db.stream_terms(
+                self.config.get_config_param('parents_only'),
+                self.config.get_config_param('empty_translation'),
+                self.config.get_config_param('include_WKI'),
+                date.today() - timedelta(days=self.config.get_config_param('last_days')),
+                include_tags=self.config.get_config_param('import_tags'),
+                include_image=media is not None,
+                **language_scope
+            )
+
+            # Adding new terms to Anki based on config.json settings
+            if routes:
+                self.deck = ', '.join(sorted({route['deck'] for route in routes.values()}))
+                creator = LanguageRouter(
+                    routes,
+                    allow_duplicates=self.config.get_config_param('allow_duplicates'),
+                    import_tags=self.config.get_config_param('import_tags'),
+                    adjust_ease=self.config.get_config_param('adjust_ease'),
+                    update_existing=self.config.get_config_param('update_existing'),
+                    source=db_path,
+                    col=self.col,
+                    metrics=self.metrics,
+                    media=media,
+                    well_known_cards=self.config.get_config_param('well_known_cards')
+                )
+                self.added = creator.create_cards(terms, progress_callback, should_cancel)
+            else:
+                self.deck = self.config.get_config_param('selected_deck')
+                creator = NoteCreator(
+                    model_name=self.config.get_config_param('selected_model'),
+                    deck_name=self.deck,
+                    allow_duplicates=self.config.get_config_param('allow_duplicates'),
+                    import_tags=self.config.get_config_param('import_tags'),
+                    adjust_ease=self.config.get_config_param('adjust_ease'),
+                    tags=self.config.get_config_param('tags'),
+                    update_existing=self.config.get_config_param('update_existing'),
+                    source=db_path,
+                    col=self.col,
+                    metrics=self.metrics,
+                    media=media,
+                    well_known_cards=self.config.get_config_param('well_known_cards')
+                )
+                selected_lang = self.config.get_config_param('selected_lang')
+                self.added = creator.create_cards(terms, selected_lang, progress_callback,
+                                                  should_cancel)
+            if creator.completed:
+                with self.metrics.span('config'):
+                    self.config.set_sync_cursors(self.col.path, db_path, db.sync_marks)
+                self.status = 'completed'
+            elif creator.cancelled:
+                self.status = 'cancelled'
+
+            self.error = creator.error
+            self.changes = creator.changes
+            self.updated = creator.updated
+            self.processed = creator.processed
+            self.ignored = self.processed - self.added - self.updated
+            if self.processed:
+                log_info('[engine] Total %d cards added to deck %s, %d updated '
+                         '(ignored %d duplicates)',
+                         self.added, self.deck, self.updated, self.ignored)
+            elif not self.error:
+                log_info('[engine] Import completed: No new terms found.')
+
+        except Exception as e:
+            log_error('[engine] Import failed: %s', e)
+            self.metrics.count('errors')
+            self.error = str(e)
+
+        finally:
+            RunHistory().record(self.metrics, self.status)
+        return self
+
+    def run_sources(self, progress_callback: Optional[Callable[[int, int], None]] = None,
+                    should_cancel: Optional[Callable[[], bool]] = None) -> 'ImportEngine':
+        """ Imports terms of several lute.db files read concurrently, with shared duplicates """
+        sources = self.config.get_lute_sources(self.col.path, self.db_path, self.full_resync)
+        sources = [source for source in sources if self.is_valid_source(source)]
+        if not sources:
+            self.error = 'No lute.db file selected'
+            return self
+        log_info('[engine] Starting import from %d LUTE databases.', len(sources))
+        self.deck = ', '.join(sorted({route['deck'] for source in sources
+                                      for route in source['routes'].values()}))
+        import_tags = self.config.get_config_param('import_tags')
+        import_images = self.config.get_config_param('import_images')
+
+        # Duplicate indexes by note type, shared by the routers of all files
+        indexed = {}
+        undo_entries = []
+        errors = []
+        completed = 0
+        cancelled = False
+        # Each file is read on its own thread and connection into a bounded queue of chunks,
+        # notes are written on this thread one file after another, in the configured order
+        with ThreadPoolExecutor(max_workers=min(SOURCE_WORKERS, len(sources))) as executor:
+            readers = []
+            for source in sources:
+                db = LuteDatabase(source['path'], self.config.get_config_param('snapshot_db'),
+                                  self.metrics, NoteMap.path_for_collection(self.col))
+                chunks = queue.Queue(maxsize=READ_AHEAD_CHUNKS)
+                stop = threading.Event()
+                future = executor.submit(self.read_source, db, source, import_tags,
+                                         import_images, chunks, stop)
+                readers.append((db, source, (chunks, stop, future)))
+
+            try:
+                for db, source, reader in readers:
+                    media = MediaImporter(source['path'], self.col, self.metrics) \
+                        if import_images else None
+                    router = LanguageRouter(
+                        source['routes'],
+                        allow_duplicates=self.config.get_config_param('allow_duplicates'),
+                        import_tags=import_tags,
+                        adjust_ease=self.config.get_config_param('adjust_ease'),
+                        update_existing=self.config.get_config_param('update_existing'),
+                        source=source['path'],
+                        col=self.col,
+                        metrics=self.metrics,
+                        media=media,
+                        well_known_cards=self.config.get_config_param('well_known_cards')
+                    )
+                    processed = self.processed
+                    router.create_cards(
+                        self.queued_terms(reader[0]),
+                        progress_callback and (lambda done, added: progress_callback(
+                            processed + done, self.added + added)),
+                        should_cancel,
+                        indexed=indexed
+                    )
+                    # A reader not read to the end (error, cancel) is stopped
+                    self.stop_reader(reader)
+                    self.added += router.added
+                    self.updated += router.updated
+                    self.processed += router.processed
+                    undo_entries.extend(creator.undo_entry
+                                        for creator in router.creators.values()
+                                        if creator.undo_entry is not None)
+                    if router.completed:
+                        with self.metrics.span('config'):
+                            self.config.set_sync_cursors(self.col.path, source['path'],
+                                                         db.sync_marks)
+                        completed += 1
+                    if router.error:
+                        errors.append(f"{source['path']}: {router.error}")
+                    if router.cancelled:
+                        cancelled = True
+                        break
+            finally:
+                for _, _, reader in readers:
+                    self.stop_reader(reader)
+
+        # Notes of all files are a single undo step
+        if undo_entries:
+            self.changes = self.col.merge_undo_entries(min(undo_entries))
+        if cancelled:
+            self.status = 'cancelled'
+        elif completed == len(sources):
+            self.status = 'completed'
+        self.error = '; '.join(errors) or None
+        self.ignored = self.processed - self.added - self.updated
+        log_info('[engine] Total %d cards added from %d databases to decks %s, %d updated '
+                 '(ignored %d duplicates)',
+                 self.added, len(sources), self.deck, self.updated, self.ignored)
+        return self
+
+    @staticmethod
+    def is_valid_source(source: Dict[str, Any]) -> bool:
+        path = source['path'] or ''
+        if path == 'Open file manager' or not path.endswith('lute.db'):
+            log_error('[engine] lute.db source %s ignored: not a lute.db file', path)
+            return False
+        return True
+
+    def read_source(self, db: LuteDatabase, source: Dict[str, Any], import_tags: bool,
+                    import_images: bool, chunks: queue.Queue, stop: threading.Event):
+        """ Reads the terms of one lute.db on a worker thread, passing them on in chunks """
+        # The queue ends with None, or with the exception that stopped reading
+        terms = db.stream_terms(
+            source['parents_only'],
+            source['empty_translation'],
+            source['include_WKI'],
+            date.today() - timedelta(days=source['last_days']),
+            include_tags=import_tags,
+            include_image=import_images,
+            language_ids=list(source['routes']),
+            sync_cursors=source['sync_cursors']
+        )
+        count = 0
+        try:
+            for chunk in NoteCreator.chunked(terms, BATCH_SIZE):
+                if stop.is_set():
+                    return
+                chunks.put(chunk)
+                count += len(chunk)
+            chunks.put(None)
+            log_info('[engine] Read %d terms from %s', count, source['path'])
+        except Exception as e:
+            log_error('[engine] Reading %s failed: %s', source['path'], e)
+            chunks.put(e)
+        finally:
+            terms.close()
+
+    @staticmethod
+    def queued_terms(chunks: queue.Queue) -> Iterator[LuteTerm]:
+        """ Yields terms of chunks put by read_source, raising its error """
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+
+    @staticmethod
+    def stop_reader(reader: Tuple[queue.Queue, threading.Event, Future]):
+        """ Stops a reader, emptying its queue until it no longer waits to put a chunk """
+        chunks, stop, future = reader
+        stop.set()
+        # A reader that has not started yet is not started at all
+        future.cancel()
+        while not future.done():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
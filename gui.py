@@ -1,14 +1,24 @@
 # gui.py
 from datetime import date, datetime, timedelta
 import os
-from typing import List
+from typing import List, Optional, Tuple
+from anki.collection import OpChanges
 from aqt import mw
+from aqt.operations import CollectionOp, QueryOp
 from aqt.qt import *
-from aqt.utils import showInfo
+from aqt.utils import showInfo, showText, tooltip
 from .config import Config
 from .database import LuteDatabase
-from .logger import log_info, log_warning
+from .diagnostics import diagnose_queries, format_report
+from .logger import log_error, log_info, log_warning
+from .media import MediaImporter
+from .metrics import RunHistory, RunMetrics
 from .note_creator import NoteCreator
+from .note_map import NoteMap
+from .preview import PreviewDialog
+from .router import LanguageRouter
+from .term import LuteTerm
+from .term_cache import TermCache
 
 
 class ImporterGui:
@@ -16,8 +26,12 @@ class ImporterGui:
         self.config = config
         self.widget = QWidget()
         self.widget.setWindowTitle('Lute to Anki Importer')
-        self.terms = []
+        self.term_count = 0
+        self.term_query = {}
+        # Routes of languages imported in one pass, empty when importing the selected language
+        self.routes = {}
         self.languages = []
+        self.preview_dialog = None
         self.selected_model = ''
         self.selected_lang = ''
         self.selected_deck = 'Default'
@@ -40,8 +54,12 @@ class ImporterGui:
         """ Create all GUI widgets """
         self.path_button = QPushButton(self.widget)
         self.connect_button = QPushButton('Click to connect to lute.db', self.widget)
+        self.diagnose_button = QPushButton('Diagnose queries', self.widget)
         self.import_button = QPushButton('Import to selected deck', self.widget)
         self.import_button.setEnabled(False)
+        self.preview_button = QPushButton('Preview import', self.widget)
+        self.preview_button.setEnabled(False)
+        self.history_button = QPushButton('Show import history', self.widget)
 
         self.model_options = self.create_model_combobox()
         self.lang_options = QComboBox(self.widget)
@@ -50,25 +68,48 @@ class ImporterGui:
         self.time_box = QSpinBox(self.widget)
         self.time_box.setRange(0, 365)
 
+        # Minutes between automatic imports while Anki is open, 0 imports only after startup
+        self.interval_box = QSpinBox(self.widget)
+        self.interval_box.setRange(0, 24 * 60)
+        self.interval_box.setSuffix(' min')
+        self.interval_box.setSpecialValueText('Only on startup')
+
+        # What is done with new cards of Well known and Ignored terms
+        self.well_known_options = QComboBox(self.widget)
+        for label, action in (('Keep new', ''), ('Suspend', 'suspend'),
+                              ('Reschedule in a year', 'reschedule')):
+            self.well_known_options.addItem(label, action)
+
         self.tag_input_box = QLineEdit(self.widget)
 
         self.parents_only_check_box = QCheckBox('Only parent terms', self.widget)
         self.empty_translation_check_box = QCheckBox('Allow blank translation', self.widget)
         self.duplicate_check_box = QCheckBox('Allow duplicates', self.widget)
+        self.update_existing_check_box = QCheckBox('Update notes changed in LUTE', self.widget)
         self.import_tags_check_box = QCheckBox('Import tags from LUTE', self.widget)
         self.adjust_ease_check_box = QCheckBox('Adjust ease based on Lute status', self.widget)
         self.include_WKI_check_box = QCheckBox('Include Well known, Ignored', self.widget)
         self.auto_import_check_box = QCheckBox('Enable Auto Import', self.widget)
+        self.full_resync_check_box = QCheckBox('Full resync (ignore last import)', self.widget)
+        self.snapshot_check_box = QCheckBox('Read from snapshot (LUTE running)', self.widget)
+        self.route_languages_check_box = QCheckBox('Import all routed languages', self.widget)
+        self.import_images_check_box = QCheckBox('Import term images', self.widget)
+        self.route_button = QPushButton('Route language to selected deck', self.widget)
 
         # Grouping together checkboxes for easier referencing and updating
         self.checkboxes = {
             'parents_only': self.parents_only_check_box,
             'empty_translation': self.empty_translation_check_box,
             'allow_duplicates': self.duplicate_check_box,
+            'update_existing': self.update_existing_check_box,
             'import_tags': self.import_tags_check_box,
             'adjust_ease': self.adjust_ease_check_box,
             'include_WKI': self.include_WKI_check_box,
-            'auto_import': self.auto_import_check_box
+            'auto_import': self.auto_import_check_box,
+            'full_resync': self.full_resync_check_box,
+            'snapshot_db': self.snapshot_check_box,
+            'route_languages': self.route_languages_check_box,
+            'import_images': self.import_images_check_box
         }
 
         self.db_group = QGroupBox('Database Connection')
@@ -103,6 +144,7 @@ class ImporterGui:
         db_layout = QFormLayout()
         db_layout.addRow('Select lute.db file to import:', self.path_button)
         db_layout.addRow(self.connect_button)
+        db_layout.addRow(self.diagnose_button)
         self.db_group.setLayout(db_layout)
 
         options_group = QGroupBox("Import Options")
@@ -110,7 +152,10 @@ class ImporterGui:
         options_layout.addRow(self.parents_only_check_box, self.empty_translation_check_box)
         options_layout.addRow(self.include_WKI_check_box, self.import_tags_check_box)
         options_layout.addRow(self.adjust_ease_check_box, self.duplicate_check_box)
+        options_layout.addRow(self.update_existing_check_box, self.import_images_check_box)
+        options_layout.addRow(self.full_resync_check_box, self.snapshot_check_box)
         options_layout.addRow('Age (days since created):', self.time_box)
+        options_layout.addRow('Well known cards:', self.well_known_options)
         options_layout.addRow('Write tags to add to cards:', self.tag_input_box)
         options_group.setLayout(options_layout)
 
@@ -119,29 +164,47 @@ class ImporterGui:
         deck_layout.addRow('Card type:', self.model_options)
         deck_layout.addRow('Language:', self.lang_options)
         deck_layout.addRow('Select deck for import:', self.deck_options)
+        deck_layout.addRow(self.route_button, self.route_languages_check_box)
         deck_group.setLayout(deck_layout)
 
         layout.addWidget(options_group)
         layout.addWidget(self.db_group)
         layout.addWidget(deck_group)
-        layout.addWidget(self.auto_import_check_box)
+        auto_import_layout = QFormLayout()
+        auto_import_layout.addRow(self.auto_import_check_box)
+        auto_import_layout.addRow('Auto import every:', self.interval_box)
+        layout.addLayout(auto_import_layout)
+        layout.addWidget(self.preview_button)
         layout.addWidget(self.import_button)
+        layout.addWidget(self.history_button)
         self.widget.setLayout(layout)
 
     def connect_signals(self):
         """ Function handling updating of values selected in GUI """
         self.path_button.clicked.connect(self.find_file)
         self.connect_button.clicked.connect(self.connect_to_lutedb)
+        self.diagnose_button.clicked.connect(self.diagnose_queries)
         self.import_button.clicked.connect(self.create_cards)
+        self.preview_button.clicked.connect(self.preview_import)
+        self.history_button.clicked.connect(self.show_history)
+        self.route_button.clicked.connect(self.route_language)
         self.model_options.currentIndexChanged.connect(self.update_variables)
         self.lang_options.currentIndexChanged.connect(self.update_variables)
         self.deck_options.currentIndexChanged.connect(self.update_variables)
         self.time_box.valueChanged.connect(self.update_variables)
+        self.time_box.valueChanged.connect(self.recount_terms)
+        self.interval_box.valueChanged.connect(self.update_variables)
+        self.well_known_options.currentIndexChanged.connect(self.update_variables)
         self.tag_input_box.editingFinished.connect(self.update_variables)
 
         # Batch connect all checkboxes to update_checks
         for checkbox in self.checkboxes.values():
             checkbox.stateChanged.connect(self.update_checks)
+        # Filters only change which cached terms are counted
+        for checkbox in (self.parents_only_check_box, self.empty_translation_check_box,
+                         self.include_WKI_check_box, self.full_resync_check_box,
+                         self.route_languages_check_box):
+            checkbox.stateChanged.connect(self.recount_terms)
 
     def load_saved_settings(self):
         """ Loading last settings from config.json file """
@@ -153,27 +216,45 @@ class ImporterGui:
         parents_only = self.config.get_config_param('parents_only')
         empty_translation = self.config.get_config_param('empty_translation')
         allow_duplicates = self.config.get_config_param('allow_duplicates')
+        update_existing = self.config.get_config_param('update_existing')
         import_tags = self.config.get_config_param('import_tags')
         adjust_ease = self.config.get_config_param('adjust_ease')
         include_WKI = self.config.get_config_param('include_WKI')
         last_days = self.config.get_config_param('last_days')
         auto_import = self.config.get_config_param('auto_import')
+        full_resync = self.config.get_config_param('full_resync')
+        snapshot_db = self.config.get_config_param('snapshot_db')
+        route_languages = bool(self.config.get_config_param('route_languages'))
+        import_images = bool(self.config.get_config_param('import_images'))
         selected_deck = self.config.get_config_param('selected_deck')
 
+        # set without saving, before the spin boxes whose changes save all of these settings
+        well_known_index = self.well_known_options.findData(
+            self.config.get_config_param('well_known_cards') or '')
+        self.well_known_options.blockSignals(True)
+        self.well_known_options.setCurrentIndex(max(well_known_index, 0))
+        self.well_known_options.blockSignals(False)
+
         # updating states of checkboxes based on loaded settings
         self.parents_only_check_box.setChecked(parents_only)
         self.empty_translation_check_box.setChecked(empty_translation)
         self.duplicate_check_box.setChecked(allow_duplicates)
+        self.update_existing_check_box.setChecked(update_existing)
         self.import_tags_check_box.setChecked(import_tags)
         self.adjust_ease_check_box.setChecked(adjust_ease)
         self.include_WKI_check_box.setChecked(include_WKI)
         self.time_box.setValue(last_days)
+        self.interval_box.setValue(self.config.get_config_param('auto_import_interval') or 0)
         self.auto_import_check_box.setChecked(auto_import)
+        self.full_resync_check_box.setChecked(full_resync)
+        self.snapshot_check_box.setChecked(snapshot_db)
+        self.route_languages_check_box.setChecked(route_languages)
+        self.import_images_check_box.setChecked(import_images)
         self.deck_options.setCurrentText(selected_deck)
 
         # Attempt automatic connection if a valid path is set
         if path != 'Open file manager' and os.path.exists(path):
-            log_info(f'[gui] Attempting to connect to LUTE database at {path}')
+            log_info('[gui] Attempting to connect to LUTE database at %s', path)
             self.connect_to_lutedb()
         else:
             log_info('[gui] No valid LUTE database path found in config.')
@@ -187,84 +268,348 @@ class ImporterGui:
         self.connect_button.setText('Click to connect')
 
     def connect_to_lutedb(self):
-        """ Connect to the LUTE database and load terms/languages """
+        """ Connect to the LUTE database and load terms/languages in a background operation """
         log_info('[gui] User initiated connection to LUTE database.')
+        self.load_terms(refresh=True)
+
+    def recount_terms(self):
+        """ Counts terms again from the term cache after filters changed, without reading LUTE """
+        if self.languages:
+            self.load_terms(refresh=False)
+
+    def load_terms(self, refresh: bool):
+        """ Counts terms matching the filters, reading lute.db only when it has changed """
         db_path = self.path_button.text()
-        db = LuteDatabase(db_path)
+        db = LuteDatabase(db_path, self.snapshot_check_box.isChecked())
+        if not db.is_lute_db():
+            showInfo('Please select a lute.db file')
+            return
+
         self.parents_only = self.parents_only_check_box.isChecked()
         self.empty_translation = self.empty_translation_check_box.isChecked()
-        self.terms, self.languages = db.connect(self.parents_only,
-                                                self.empty_translation,
-                                                self.include_WKI_check_box.isChecked(),
-                                                date.today() - timedelta(days=self.time_box.value())
-                                                )
+        current_lang = self.config.get_config_param('selected_lang')
+        cutoff_date = date.today() - timedelta(days=self.time_box.value())
+
+        # Loading only terms not imported yet or changed since the last import unless full
+        # resync is set, of all routed languages at once when language routing is enabled
+        self.routes, language_scope = self.config.get_import_scope(mw.col.path, db_path)
+        # Terms are only counted here and streamed from lute.db again when importing
+        self.term_query = {
+            'parents_only': self.parents_only,
+            'empty_translation': self.empty_translation,
+            'include_WKI': self.include_WKI_check_box.isChecked(),
+            'cutoff_date': cutoff_date,
+            **language_scope
+        }
+        term_query = self.term_query
+        note_map_path = NoteMap.path_for_collection(mw.col)
+
+        def count_terms(cache: TermCache) -> Tuple[int, List]:
+            # Sync cursors only skip terms already linked to a note of this collection
+            linked_woids = NoteMap.load_linked_woids(note_map_path, db_path)
+            return cache.count_terms(**term_query, linked_woids=linked_woids)
+
+        # Terms are counted in memory from the cache, which is read again only when lute.db
+        # was written to since
+        cache = TermCache.for_database(db_path)
+        if cache.is_fresh() or (cache.loaded and not refresh):
+            self.on_terms_loaded(db_path, current_lang, count_terms(cache))
+            return
+
+        self.connect_button.setEnabled(False)
+        self.import_button.setEnabled(False)
+        self.preview_button.setEnabled(False)
+        self.connect_button.setText('Loading terms...')
+        op = QueryOp(
+            parent=self.widget,
+            op=lambda col: count_terms(cache.refresh(db)),
+            success=lambda result: self.on_terms_loaded(db_path, current_lang, result)
+        )
+        op.failure(self.on_connect_failed)
+        op.with_progress('Loading terms from LUTE...').run_in_background()
+
+    def on_connect_failed(self, error: Exception):
+        """ Shows error of the background database operation """
+        log_error('[gui] Database connection error: %s', error)
+        self.connect_button.setEnabled(True)
+        self.connect_button.setText('Click to connect')
+        showInfo(f'Database connection error: {str(error)}')
+
+    def on_terms_loaded(self, db_path: str, current_lang, result: Tuple[int, List]):
+        """ Updates the window after terms were counted and languages loaded """
+        self.term_count, self.languages = result
+        self.connect_button.setEnabled(True)
 
         # Get the current time in HH:MM:SS format
         current_time = datetime.now().strftime("%H:%M:%S")
 
         # Update the Database Connection group title
-        current_lang = self.config.get_config_param('selected_lang')
-        if current_lang:
-            self.terms = [term for term in self.terms if term[2] == current_lang]
-        self.db_group.setTitle(f"Database Connection - {current_time} ({len(self.terms)} terms)")
+        self.db_group.setTitle(f"Database Connection - {current_time} ({self.term_count} terms)")
 
         # Update connect_and import button after loading terms
         self.connect_button.setText('Reload terms')
-        self.import_button.setText(f'Import {len(self.terms)} terms to deck {self.selected_deck}')
+        if self.routes:
+            self.import_button.setText(
+                f'Import {self.term_count} terms of {len(self.routes)} routed languages')
+        else:
+            self.import_button.setText(
+                f'Import {self.term_count} terms to deck {self.selected_deck}')
 
-        if self.terms and self.languages:
-            # Update language combo box
+        if self.languages:
+            # Update language combo box (signals blocked so refilling it does not reload terms)
+            self.lang_options.blockSignals(True)
             self.lang_options.clear()
             for lang in self.languages:
                 self.lang_options.addItem(lang[1])
                 self.lang_options.setItemData(self.lang_options.count() - 1, lang[0])
 
-            lg_index = self.lang_options.findData(self.config.get_config_param('selected_lang'))
+            lg_index = self.lang_options.findData(current_lang)
             if lg_index >= 0:
                 self.lang_options.setCurrentIndex(lg_index)
             else:
                 self.lang_options.setCurrentIndex(0)
+            self.lang_options.blockSignals(False)
+            self.selected_lang = self.lang_options.itemData(self.lang_options.currentIndex())
+            # With signals blocked the refill no longer reads the note type and deck, which may
+            # not change after loading settings, so they are read here
+            self.update_variables()
 
             # Save path and update UI - enabling creation of Anki notes
             self.config.update_config({'lutedb_path': db_path})
-            self.import_button.setEnabled(True)
+            self.import_button.setEnabled(bool(self.term_count))
+            self.preview_button.setEnabled(bool(self.term_count))
 
-        else:
+            # Terms were loaded for a language that is not available, reload for the selected one
+            if self.selected_lang != current_lang:
+                self.config.update_config({'selected_lang': self.selected_lang})
+                self.recount_terms()
+                return
+
+        if not self.term_count:
             log_warning('[gui] No terms meet criteria based on chosen filters')
 
     def update_variables(self):
         """ Update values when user selects different options """
         if self.lang_options.currentIndex() >= 0:
-            self.selected_lang = self.lang_options.itemData(self.lang_options.currentIndex())
-            if self.selected_lang:
+            selected_lang = self.lang_options.itemData(self.lang_options.currentIndex())
+            if selected_lang and selected_lang != self.selected_lang:
+                self.selected_lang = selected_lang
                 self.config.update_config({'selected_lang': self.selected_lang})
+                # Terms are counted again for the new language
+                self.recount_terms()
 
         self.selected_model = self.model_options.currentText()
-        self.config.update_config({'selected_model': self.selected_model})
         self.selected_deck = self.deck_options.currentText()
-        self.config.update_config({'selected_deck': self.selected_deck})
         self.last_days = self.time_box.value()
-        self.config.update_config({'last_days': self.last_days})
         self.tags = self.tag_input_box.text().split()
-        self.config.update_config({'tags': self.tags})
+        self.config.update_config({
+            'selected_model': self.selected_model,
+            'selected_deck': self.selected_deck,
+            'last_days': self.last_days,
+            'auto_import_interval': self.interval_box.value(),
+            'well_known_cards': self.well_known_options.currentData(),
+            'tags': self.tags
+        })
 
     def update_checks(self):
         """ Update checkbox settings """
         updates = {key: checkbox.isChecked() for key, checkbox in self.checkboxes.items()}
         self.config.update_config(updates)
 
-    def create_cards(self):
-        log_info('User initiated card creation process.')
-        creator = NoteCreator(
+    def build_creator(self, metrics: RunMetrics):
+        """ Creates the importer of the selected deck, or of all routed languages """
+        db_path = self.path_button.text()
+        # Images are read from LUTE's data folder next to lute.db
+        media = None
+        if self.import_images_check_box.isChecked():
+            media = MediaImporter(db_path, mw.col, metrics)
+        if self.routes:
+            # Every routed language goes to its own deck and note type in one pass
+            return LanguageRouter(
+                self.routes,
+                allow_duplicates=self.duplicate_check_box.isChecked(),
+                import_tags=self.import_tags_check_box.isChecked(),
+                adjust_ease=self.adjust_ease_check_box.isChecked(),
+                update_existing=self.update_existing_check_box.isChecked(),
+                source=db_path,
+                col=mw.col,
+                metrics=metrics,
+                media=media,
+                well_known_cards=self.well_known_options.currentData()
+            )
+        return NoteCreator(
             model_name=self.selected_model,
             deck_name=self.selected_deck,
             allow_duplicates=self.duplicate_check_box.isChecked(),
             import_tags=self.import_tags_check_box.isChecked(),
             adjust_ease=self.adjust_ease_check_box.isChecked(),
-            tags=self.tag_input_box.text().split()
+            tags=self.tag_input_box.text().split(),
+            update_existing=self.update_existing_check_box.isChecked(),
+            source=db_path,
+            col=mw.col,
+            metrics=metrics,
+            media=media,
+            well_known_cards=self.well_known_options.currentData()
+        )
+
+    def stream_terms(self, db: LuteDatabase):
+        """ Terms are streamed from lute.db with the filters used when they were counted """
+        # Tags and images are only read when they are imported
+        return db.stream_terms(**self.term_query,
+                               include_tags=self.import_tags_check_box.isChecked(),
+                               include_image=self.import_images_check_box.isChecked())
+
+    def preview_import(self):
+        """ Classifies terms as add, update, skip or filtered without importing them """
+        metrics = RunMetrics('preview')
+        creator = self.build_creator(metrics)
+        db = LuteDatabase(self.path_button.text(), self.snapshot_check_box.isChecked(), metrics,
+                          NoteMap.path_for_collection(mw.col))
+        terms = self.stream_terms(db)
+        routes = self.routes
+        selected_lang = self.selected_lang
+        languages = dict(self.languages)
+
+        def dry_run(col) -> List:
+            if routes:
+                return creator.dry_run(terms)
+            return creator.dry_run(terms, selected_lang)
+
+        def on_success(rows: List):
+            self.preview_button.setEnabled(True)
+            self.preview_dialog = PreviewDialog(rows, languages, self.import_selected,
+                                                parent=self.widget)
+            self.preview_dialog.show()
+
+        def on_failure(error: Exception):
+            self.preview_button.setEnabled(True)
+            log_error('[gui] Import preview failed: %s', error)
+            showInfo(f'Error previewing import: {str(error)}')
+
+        self.preview_button.setEnabled(False)
+        op = QueryOp(parent=self.widget, op=dry_run, success=on_success)
+        op.failure(on_failure)
+        op.with_progress('Classifying terms...').run_in_background()
+
+    def import_selected(self, terms: List[LuteTerm]):
+        """ Imports terms selected in the preview """
+        log_info('[gui] Importing %d terms selected in the preview', len(terms))
+        self.run_import(terms)
+
+    def create_cards(self):
+        """ Imports all terms matching the filters """
+        log_info('User initiated card creation process.')
+        self.run_import()
+
+    def run_import(self, selected: Optional[List[LuteTerm]] = None):
+        """ Imports terms in a background collection operation with progress and cancel """
+        metrics = RunMetrics('manual')
+        routes = self.routes
+        db_path = self.path_button.text()
+        creator = self.build_creator(metrics)
+        db = LuteDatabase(db_path, self.snapshot_check_box.isChecked(), metrics,
+                          NoteMap.path_for_collection(mw.col))
+        terms = self.stream_terms(db) if selected is None else selected
+        selected_lang = self.selected_lang
+        selected_deck = self.selected_deck
+        if routes:
+            selected_deck = ', '.join(sorted({route['deck'] for route in routes.values()}))
+        term_count = self.term_count if selected is None else len(selected)
+
+        # Reporting progress after every chunk, called from the background thread
+        def on_progress(processed: int, added: int):
+            read = db.rows_read if selected is None else processed
+            label = (f'Read {read} of {term_count} terms, {added} notes added\n'
+                     f'(close this window to cancel)')
+            mw.taskman.run_on_main(
+                lambda: mw.progress.update(label=label, value=processed, max=term_count))
+
+        def import_terms(col) -> OpChanges:
+            if routes:
+                creator.create_cards(terms, on_progress, mw.progress.want_cancel)
+            else:
+                creator.create_cards(terms, selected_lang, on_progress, mw.progress.want_cancel)
+            return creator.changes or OpChanges()
+
+        def on_success(_changes: OpChanges):
+            self.import_button.setEnabled(True)
+            cards_added = creator.added
+            # Moving the sync cursor so the next load skips imported terms that did not change,
+            # not after importing a selection, as the other terms were not imported
+            if creator.completed and selected is None:
+                with metrics.span('config'):
+                    self.config.set_sync_cursors(mw.col.path, db_path, db.sync_marks)
+            run_status = 'completed' if creator.completed else 'failed'
+            RunHistory().record(metrics, 'cancelled' if creator.cancelled else run_status)
+            if creator.error:
+                showInfo(f'Error creating cards: {creator.error}')
+            status = ' (cancelled)' if creator.cancelled else ''
+            ignored = creator.processed - cards_added - creator.updated
+            log_info('[gui] Total %d cards added to deck %s%s, %d updated (ignored %d terms)',
+                     cards_added, selected_deck, status, creator.updated, ignored)
+            showInfo(f'Total {cards_added} cards added to deck {selected_deck}{status}, '
+                     f'{creator.updated} updated\n(ignored {ignored} terms)')
+
+        def on_failure(error: Exception):
+            self.import_button.setEnabled(True)
+            metrics.count('errors')
+            RunHistory().record(metrics, 'failed')
+            log_error('[gui] Import failed: %s', error)
+            showInfo(f'Error creating cards: {str(error)}')
+
+        self.import_button.setEnabled(False)
+        op = CollectionOp(parent=self.widget, op=import_terms)
+        op.success(on_success)
+        op.failure(on_failure)
+        op.run_in_background()
+
+    def route_language(self):
+        """ Routes the selected language to the selected deck, card type and tags """
+        if not self.selected_lang:
+            showInfo('Connect to lute.db and select a language first.')
+            return
+        self.config.set_language_route(self.selected_lang, self.selected_deck,
+                                       self.selected_model, self.tag_input_box.text().split())
+        language = self.lang_options.currentText()
+        tooltip(f'{language} terms are imported to deck {self.selected_deck}',
+                parent=self.widget)
+        if self.route_languages_check_box.isChecked():
+            self.recount_terms()
+
+    def diagnose_queries(self):
+        """ Shows plan and timing of every query variant run against the selected lute.db """
+        db = LuteDatabase(self.path_button.text(), self.snapshot_check_box.isChecked())
+        if not db.is_lute_db():
+            showInfo('Please select a lute.db file')
+            return
+
+        language_id = self.selected_lang or None
+        cutoff_date = date.today() - timedelta(days=self.time_box.value())
+        self.diagnose_button.setEnabled(False)
+
+        def on_success(results: List):
+            self.diagnose_button.setEnabled(True)
+            showText(format_report(results), parent=self.widget,
+                     title='LUTE query diagnostics')
+
+        def on_failure(error: Exception):
+            self.diagnose_button.setEnabled(True)
+            log_error('[gui] Query diagnostics failed: %s', error)
+            showInfo(f'Query diagnostics failed: {str(error)}')
+
+        op = QueryOp(
+            parent=self.widget,
+            op=lambda col: diagnose_queries(db, cutoff_date, language_id),
+            success=on_success
         )
-        cards_added = creator.create_cards(self.terms, self.selected_lang)
-        log_info(f'[gui] Total {cards_added} cards added to deck {self.selected_deck}\n'
-                 f'(ignored {len(self.terms)-cards_added} terms)')
-        showInfo(f'Total {cards_added} cards added to deck {self.selected_deck}\n'
-                 f'(ignored {len(self.terms)-cards_added} terms)')
+        op.failure(on_failure)
+        op.with_progress('Diagnosing LUTE queries...').run_in_background()
+
+    def show_history(self):
+        """ Shows timings and counters of recent import runs, the most recent first """
+        runs = RunHistory().load()
+        if not runs:
+            showInfo('No import runs recorded yet.')
+            return
+        text = '\n\n'.join(RunHistory.format_run(run) for run in reversed(runs))
+        showText(text, parent=self.widget, title='LUTE import history')
@@ -1,34 +1,73 @@
 # logger.py
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
 
 LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lute_importer.log')
+# Size of the log file before it is rotated, and number of rotated files kept
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+# Records waiting for the writer thread, further records are dropped instead of blocking
+QUEUE_SIZE = 10000
 
 
-# Configure the logger
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.WARNING,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    force=True  # Force reconfiguration (Python 3.8+)
-)
+class BoundedQueueHandler(QueueHandler):
+    """ Hands records to the writer thread, drops them when the queue is full """
 
+    def __init__(self, record_queue: queue.Queue):
+        super().__init__(record_queue)
+        self.dropped = 0
 
-def log_debug(message):
-    logging.debug(message)
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 
-def log_info(message):
-    logging.info(message)
+def setup_logger() -> logging.Logger:
+    """ Add-on logger writing to a rotating file from a background thread """
+    # Own logger instead of the root one, so Anki and other add-ons are not reconfigured
+    add_on_logger = logging.getLogger('lute_importer')
+    if add_on_logger.handlers:
+        return add_on_logger
 
+    add_on_logger.setLevel(logging.WARNING)
+    add_on_logger.propagate = False
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                       backupCount=LOG_BACKUPS, encoding='utf-8', delay=True)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    record_queue = queue.Queue(QUEUE_SIZE)
+    add_on_logger.addHandler(BoundedQueueHandler(record_queue))
 
-def log_warning(message):
-    logging.warning(message)
+    listener = QueueListener(record_queue, file_handler)
+    listener.start()
+    # Writes records still in the queue when Anki closes
+    atexit.register(listener.stop)
+    return add_on_logger
 
 
-def log_error(message):
-    logging.error(message)
+logger = setup_logger()
 
 
-def log_critical(message):
-    logging.critical(message)
+# Messages use %-style arguments, formatted only when the level is enabled
+def log_debug(message, *args):
+    logger.debug(message, *args)
+
+
+def log_info(message, *args):
+    logger.info(message, *args)
+
+
+def log_warning(message, *args):
+    logger.warning(message, *args)
+
+
+def log_error(message, *args):
+    logger.error(message, *args)
+
+
+def log_critical(message, *args):
+    logger.critical(message, *args)
@@ -0,0 +1,29 @@
+# lute_import.py
+""" Command line import of LUTE terms into an Anki collection, without starting Anki
+
+Needs the anki package (pip install anki) and the collection not being open in Anki.
+
+Usage: python lute_import.py "$HOME/.local/share/Anki2/User 1/collection.anki2" [--config FILE]
+"""
+import importlib
+import os
+import sys
+import types
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+# Name the add-on modules are loaded under, they use relative imports
+PACKAGE = 'lute_importer'
+
+
+def load_addon() -> types.ModuleType:
+    """ Loads the add-on folder as a package without running __init__.py (needs Anki's window) """
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ADDON_DIR]
+    sys.modules[PACKAGE] = package
+    return package
+
+
+if __name__ == '__main__':
+    load_addon()
+    cli = importlib.import_module(f'{PACKAGE}.cli')
+    sys.exit(cli.main())
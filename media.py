@@ -0,0 +1,142 @@
+# media.py
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+from typing import Dict, Iterable, Optional, Tuple
+from .logger import log_info, log_warning
+from .metrics import RunMetrics
+from .note_map import NoteMap
+
+# Folder of the LUTE data directory (next to lute.db) holding term images
+IMAGE_FOLDER = 'userimages'
+# Threads hashing and copying image files
+MEDIA_WORKERS = 4
+# Bytes read at once when hashing an image
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class MediaImporter:
+    """ Copies images of LUTE terms into the collection's media folder, named by content """
+
+    def __init__(self, db_path: str, col, metrics: Optional[RunMetrics] = None):
+        self.col = col
+        self.image_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), IMAGE_FOLDER)
+        self.media_dir = col.media.dir()
+        self.metrics = metrics or RunMetrics('media')
+        self.note_map = None
+        # {absolute image path: (size, mtime, content hash)} of images hashed in earlier runs
+        self.hash_cache = None
+        # {WiSource: media file name or None} of images resolved in this run
+        self.resolved = {}
+
+    def resolve(self, sources: Iterable[Optional[str]],
+                copy: bool = True) -> Dict[str, Optional[str]]:
+        """ Returns media file names of image sources, copying new images into the media folder """
+        # Without copy (dry run) names are only computed and nothing is written, an importer
+        # used for a dry run is not used for importing afterwards, as resolved images are not
+        # copied again
+        pending = {source for source in sources if source and source not in self.resolved}
+        if not pending:
+            return self.resolved
+
+        with self.metrics.span('media'):
+            if self.hash_cache is None:
+                self.note_map = NoteMap(NoteMap.path_for_collection(self.col), read_only=not copy)
+                self.hash_cache = self.note_map.load_image_hashes()
+
+            # Files are only hashed when new or changed since they were hashed last time
+            to_hash = {}
+            paths = {}
+            for source in pending:
+                path, stat = self.locate(source)
+                paths[source] = path
+                if stat is None:
+                    self.resolved[source] = None
+                    continue
+                cached = self.hash_cache.get(path)
+                if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                    self.resolved[source] = self.media_name(source, cached[2])
+                    self.metrics.count('images_cached')
+                else:
+                    to_hash[source] = (path, stat)
+
+            with ThreadPoolExecutor(max_workers=MEDIA_WORKERS) as pool:
+                digests = dict(zip(to_hash, pool.map(self.hash_file,
+                                                     (path for path, _ in to_hash.values()))))
+                hashed = []
+                for source, digest in digests.items():
+                    path, stat = to_hash[source]
+                    if digest is None:
+                        self.resolved[source] = None
+                        continue
+                    self.hash_cache[path] = (stat.st_size, stat.st_mtime_ns, digest)
+                    hashed.append((path, stat.st_size, stat.st_mtime_ns, digest))
+                    self.resolved[source] = self.media_name(source, digest)
+                self.metrics.count('images_hashed', len(hashed))
+                if hashed and copy:
+                    self.note_map.save_image_hashes(hashed)
+
+                # Content named files already in the media folder hold the same image
+                copies = {}
+                for source in pending if copy else ():
+                    name = self.resolved[source]
+                    target = os.path.join(self.media_dir, name) if name else None
+                    if target and target not in copies and not os.path.exists(target):
+                        copies[target] = (paths[source], target)
+                copied = sum(pool.map(self.copy_file, copies.values()))
+                self.metrics.count('images_copied', copied)
+
+        log_info('[media] Resolved %d images, %d copied to media', len(pending), copied)
+        return self.resolved
+
+    def locate(self, source: str) -> Tuple[str, Optional[os.stat_result]]:
+        """ Returns path and stat of an image in LUTE's image folder, no stat if not found """
+        path = os.path.normpath(os.path.join(self.image_dir, source))
+        # WiSource is relative to the image folder, other locations are not read
+        if os.path.commonpath([path, self.image_dir]) != self.image_dir:
+            log_warning('[media] Image outside of %s ignored: %s', self.image_dir, source)
+            return path, None
+        try:
+            return path, os.stat(path)
+        except OSError:
+            self.metrics.count('images_missing')
+            return path, None
+
+    @staticmethod
+    def media_name(source: str, digest: str) -> str:
+        """ Media file name derived from image content, keeping the original extension """
+        extension = os.path.splitext(source)[1].lower()
+        return f'lute-{digest}{extension}'
+
+    @staticmethod
+    def hash_file(path: str) -> Optional[str]:
+        try:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+            return digest.hexdigest()
+        except OSError as e:
+            log_warning('[media] Could not read image %s: %s', path, e)
+            return None
+
+    @staticmethod
+    def copy_file(paths: Tuple[str, str]) -> int:
+        source, target = paths
+        try:
+            shutil.copyfile(source, target)
+            return 1
+        except OSError as e:
+            log_warning('[media] Could not copy image %s: %s', source, e)
+            return 0
+
+    @staticmethod
+    def image_tag(name: str) -> str:
+        return f'<img src="{name}">'
+
+    def close(self):
+        if self.note_map is not None:
+            self.note_map.close()
+            self.note_map = None
+        self.hash_cache = None
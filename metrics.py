@@ -0,0 +1,111 @@
+# metrics.py
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+from .logger import log_info, log_warning
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_history.json')
+# Number of most recent runs kept in the history file
+HISTORY_SIZE = 50
+
+
+class RunMetrics:
+    """ Span timings and counters of one import run """
+
+    def __init__(self, trigger: str):
+        self.trigger = trigger
+        self.started = datetime.now()
+        self.start_time = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.status = 'running'
+        # Several lute.db files are read concurrently into the same metrics
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """ Adds the time spent in the block to the span, spans with the same name accumulate """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self, status: str) -> Dict[str, Any]:
+        """ Ends the run and returns its summary """
+        self.status = status
+        summary = self.summary()
+        log_info('[metrics] %s run %s in %.3fs %s %s', self.trigger, status,
+                 summary['duration'], summary['spans'], summary['counters'])
+        return summary
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'trigger': self.trigger,
+            'status': self.status,
+            'duration': round(time.perf_counter() - self.start_time, 4),
+            'spans': {name: round(seconds, 4) for name, seconds in self.spans.items()},
+            'counters': dict(self.counters)
+        }
+
+
+class RunHistory:
+    """ JSON file with summaries of the last HISTORY_SIZE import runs """
+    # Manual and auto-import runs may finish at the same time
+    lock = threading.Lock()
+
+    def __init__(self, path: str = HISTORY_FILE):
+        self.path = path
+
+    def load(self) -> List[Dict[str, Any]]:
+        """ Returns run summaries, the most recent last """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            log_warning('[metrics] Could not read run history: %s', e)
+            return []
+
+    def append(self, summary: Dict[str, Any]):
+        """ Adds a run summary, dropping the oldest runs over HISTORY_SIZE """
+        with self.lock:
+            runs = (self.load() + [summary])[-HISTORY_SIZE:]
+            # Unique temporary file, as the command line import may write at the same time
+            try:
+                handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',
+                                                     suffix='.tmp')
+                try:
+                    with os.fdopen(handle, 'w', encoding='utf-8') as f:
+                        json.dump(runs, f, indent=2)
+                    os.replace(temp_path, self.path)
+                except Exception:
+                    os.remove(temp_path)
+                    raise
+            except OSError as e:
+                log_warning('[metrics] Could not write run history: %s', e)
+
+    def record(self, metrics: RunMetrics, status: str):
+        self.append(metrics.finish(status))
+
+    @staticmethod
+    def format_run(run: Dict[str, Any]) -> str:
+        """ One readable block per run for the history window """
+        spans = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in run['spans'].items())
+        counters = ', '.join(f'{name} {value}' for name, value in run['counters'].items())
+        return (f'{run["started"]}  {run["trigger"]}  {run["status"]}  {run["duration"]:.2f}s\n'
+                f'    {spans or "no spans"}\n'
+                f'    {counters or "no counters"}')
@@ -0,0 +1,54 @@
+# normalize.py
+import html
+import re
+from typing import Iterable, List, Optional, Tuple
+import unicodedata
+from .term import LuteTerm
+
+# Zero width space used by LUTE to join multi-word terms, removed for Anki
+ZWS = '\u200B'
+# Line breaks of any platform, shown as <br> in note fields
+LINE_BREAKS = re.compile(r'\r\n|\r|\n')
+
+# Front field, back field (without image) and duplicate key of a term
+Normalized = Tuple[str, str, str]
+
+
+def clean_text(text: Optional[str]) -> str:
+    """ LUTE text without zero width spaces, in composed (NFC) form """
+    # str.replace of a single character is many times faster than str.translate
+    return unicodedata.normalize('NFC', (text or '').replace(ZWS, ''))
+
+
+def to_field(text: str) -> str:
+    """ Plain text as note field HTML, escaped and with line breaks kept """
+    text = html.escape(text, quote=False)
+    # Most terms are a single line, the pattern only runs when there is a line break
+    if '\n' in text or '\r' in text:
+        text = LINE_BREAKS.sub('<br>', text)
+    return text
+
+
+def text_key(text: str) -> str:
+    """ Duplicate key of cleaned text, case-insensitive like LUTE's WoTextLC """
+    return text.strip().casefold()
+
+
+def dedupe_key(text: str) -> str:
+    """ Duplicate key of raw LUTE text """
+    return text_key(clean_text(text))
+
+
+def field_key(field: str) -> str:
+    """ Duplicate key of a note field, the same as of the term the note was created from """
+    return dedupe_key(html.unescape(field) if '&' in field else field)
+
+
+def normalize_terms(terms: Iterable[LuteTerm]) -> List[Normalized]:
+    """ Fields and duplicate key of every term of a chunk, computed once per term """
+    normalized = []
+    for term in terms:
+        text = clean_text(term.text)
+        normalized.append((to_field(text), to_field(clean_text(term.translation)),
+                           text_key(text)))
+    return normalized
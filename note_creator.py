@@ -1,98 +1,484 @@
 # note_creator.py
-from typing import List, Optional
+import hashlib
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from anki.collection import AddNoteRequest
 from anki.notes import Note
-from aqt import mw
-from aqt.utils import showInfo
 from .logger import log_error, log_info
+from .media import MediaImporter
+from .metrics import RunMetrics
+from .normalize import field_key, normalize_terms, Normalized
+from .note_map import NoteMap
+from .scheduling import ID_CHUNK, StatusScheduler
+from .term import LuteTerm
+
+# Separator of note fields in Anki's notes table
+FIELD_SEPARATOR = '\x1f'
+# Number of notes added to the collection with one bulk call
+BATCH_SIZE = 500
+# Number of leading note fields filled from LUTE (term and translation)
+MAPPED_FIELDS = 2
+# Placeholder in the duplicate index for notes being added in the current chunk
+RESERVED = 0
+# Errors of single notes logged per import run, further ones are only counted
+LOGGED_NOTE_ERRORS = 5
+# What importing a term would do, as shown by a dry run
+ADD = 'add'
+UPDATE = 'update'
+SKIP = 'skip'
+FILTERED = 'filtered'
 
 
 class NoteCreator:
     def __init__(self, model_name: str, deck_name: str, allow_duplicates: bool,
-                 import_tags: bool, adjust_ease: bool, tags: List[str]):
+                 import_tags: bool, adjust_ease: bool, tags: List[str],
+                 update_existing: bool = False, source: Optional[str] = None, col=None,
+                 metrics: Optional[RunMetrics] = None, media: Optional[MediaImporter] = None,
+                 well_known_cards: str = ''):
         """ Initialization of passed values used for card creation """
+        # Collection notes are written to, the one opened in Anki unless passed explicitly
+        if col is None:
+            # Collection of the profile open in Anki, outside of Anki it has to be passed
+            from aqt import mw
+            col = mw.col
+        self.col = col
+        # Timings and counters of the import run, shared with LuteDatabase by the caller
+        self.metrics = metrics or RunMetrics('note_creator')
+        # Copies term images into the collection when images are imported
+        self.media = media
         self.model_name = model_name
         self.deck_name = deck_name
         self.allow_duplicates = allow_duplicates
         self.import_tags = import_tags
         self.adjust_ease = adjust_ease
+        # Cards of new notes are scheduled by LUTE status after all notes are added
+        self.scheduler = StatusScheduler(self.col, adjust_ease, well_known_cards, self.metrics)
         self.tags = tags
+        self.update_existing = update_existing
+        # Path of lute.db the terms come from, links terms to notes in the NoteMap store
+        self.source = NoteMap.source_key(source) if source else None
+        self.note_map = None
+        self.linked_notes = {}
+        self.duplicate_index = {}
+        self.model = None
+        self.deck_id = None
+        self.undo_entry = None
+        self.completed = False
+        self.cancelled = False
+        self.error = None
+        self.changes = None
+        self.processed = 0
+        self.added = 0
+        self.updated = 0
+        self.note_errors = 0
 
-    def create_cards(self, terms: List, selected_lang: str) -> int:
+    def create_cards(self, terms: Iterable[LuteTerm], selected_lang: str,
+                     progress_callback: Optional[Callable[[int, int], None]] = None,
+                     should_cancel: Optional[Callable[[], bool]] = None) -> int:
         """ Adds Anki cards from LUTE terms into deck with specified settings """
-        log_info(f'[note_creator] Starting to create notes in deck: {self.deck_name}')
+        # Can run in a background operation, so errors are kept in self.error for the caller
+        log_info('[note_creator] Starting to create notes in deck: %s', self.deck_name)
+        self.reset()
+        try:
+            with self.metrics.span('index'):
+                self.resolve_destination()
+                self.build_duplicate_index()
+                self.load_linked_notes()
+
+            # terms are turned into notes and added in chunks, each chunk with one bulk call;
+            # terms may be a stream, so only one chunk is held in memory at a time
+            for chunk in self.chunked(terms, BATCH_SIZE):
+                self.import_chunk(chunk, selected_lang)
+                if progress_callback:
+                    progress_callback(self.processed, self.added)
+                if should_cancel and should_cancel():
+                    log_info('[note_creator] Import cancelled after %d terms', self.processed)
+                    self.cancelled = True
+                    break
+
+            log_info('[note_creator] Total %d cards added to deck %s, %d notes updated',
+                     self.added, self.deck_name, self.updated)
+            self.completed = not self.cancelled
+
+        except Exception as e:
+            log_error('[note_creator] Error creating cards: %s', e)
+            self.metrics.count('errors')
+            self.error = str(e)
+
+        self.finish()
+        return self.added
+
+    def dry_run(self, terms: Iterable[LuteTerm], selected_lang: str
+                ) -> List[Tuple[str, LuteTerm]]:
+        """ Returns (action, term) of every term, without writing to the collection """
+        # Runs in a background operation, errors are raised to the caller
+        self.reset()
         try:
-            # sets in which deck the cards should be created and initializes counter (created cards)
-            deck_id = mw.col.decks.id_for_name(self.deck_name)
-            counter = 0
+            with self.metrics.span('index'):
+                self.resolve_destination()
+                self.build_duplicate_index()
+                self.load_linked_notes(prune=False)
+            rows = []
+            for chunk in self.chunked(terms, BATCH_SIZE):
+                images = self.preview_images(chunk, self.media)
+                rows.extend((self.classify(term, normalized, selected_lang,
+                                           images.get(term.image)), term)
+                            for term, normalized in zip(chunk, normalize_terms(chunk)))
+                self.processed += len(chunk)
+        finally:
+            self.finish(merge_undo=False)
+        log_info('[note_creator] Dry run of %d terms for deck %s', len(rows), self.deck_name)
+        return rows
+
+    @staticmethod
+    def preview_images(terms: List[LuteTerm], media: Optional[MediaImporter]
+                       ) -> Dict[str, Optional[str]]:
+        """ Media names of images of terms, computed without copying them into the collection """
+        if media is None:
+            return {}
+        return media.resolve((term.image for term in terms), copy=False)
+
+    def classify(self, term: LuteTerm, normalized: Normalized, selected_lang: str,
+                 image: Optional[str] = None) -> str:
+        """ Returns what add_notes_batch would do with a term, using the in-memory indexes """
+        if not self.should_process_term(term, selected_lang):
+            return FILTERED
+        key = normalized[2]
+        existing = self.find_existing_note(term, key)
+        if existing is not None:
+            _, stored_hash, claimed = existing
+            if self.update_existing and not claimed:
+                if self.content_hash(self.build_fields(normalized, image)) != stored_hash:
+                    return UPDATE
+            return SKIP
+        # Reserved like a note being added, so later terms with the same front are skipped
+        self.duplicate_index.setdefault(key, RESERVED)
+        return ADD
+
+    def reset(self):
+        """ Clears results of a previous import run """
+        self.completed = False
+        self.cancelled = False
+        self.error = None
+        self.changes = None
+        self.undo_entry = None
+        self.processed = 0
+        self.added = 0
+        self.updated = 0
+        self.note_errors = 0
+        self.scheduler.clear()
+
+    def resolve_destination(self):
+        """ Resolves note type and deck only once for the whole import """
+        self.model = self.col.models.by_name(self.model_name)
+        self.deck_id = self.col.decks.id_for_name(self.deck_name)
+
+    def import_chunk(self, chunk: List[LuteTerm], selected_lang: str) -> int:
+        """ Imports one chunk of terms, returns the number of notes added """
+        added = self.add_notes_batch(chunk, selected_lang, self.deck_id)
+        self.added += added
+        self.processed += len(chunk)
+        self.metrics.count('terms_processed', len(chunk))
+        return added
+
+    def finish(self, merge_undo: bool = True):
+        """ Closes the mapping store and merges all chunks into a single undo step """
+        if self.note_errors > LOGGED_NOTE_ERRORS:
+            log_error('[note_creator] %d more note errors not logged',
+                      self.note_errors - LOGGED_NOTE_ERRORS)
+
+        if self.note_map is not None:
+            self.note_map.close()
+            self.note_map = None
+        if self.media is not None:
+            self.media.close()
+
+        # Cards of all added notes are scheduled with one call per LUTE status
+        try:
+            self.scheduler.apply()
+        except Exception as e:
+            log_error('[note_creator] Error scheduling cards: %s', e)
+            self.metrics.count('errors')
+            self.scheduler.clear()
+
+        # all chunks (also of cancelled or failed imports) are merged into a single undo step
+        if merge_undo and self.undo_entry is not None:
+            self.changes = self.col.merge_undo_entries(self.undo_entry)
+
+    def share_index(self, other: 'NoteCreator'):
+        """ Uses the duplicate index of another creator importing into the same note type """
+        self.duplicate_index = other.duplicate_index
+
+    def share_links(self, other: 'NoteCreator'):
+        """ Uses term links loaded by another creator importing from the same source """
+        self.note_map = other.note_map
+        self.linked_notes = other.linked_notes
+
+    def load_linked_notes(self, prune: bool = True):
+        """ Loads links of already imported terms and drops links of deleted notes """
+        # Without prune (dry run) the store is opened read-only and links of deleted notes
+        # are only skipped, so a preview does not write to it
+        self.linked_notes = {}
+        if not self.source:
+            return
+
+        self.note_map = NoteMap(NoteMap.path_for_collection(self.col), read_only=not prune)
+        self.linked_notes = self.note_map.load(self.source)
+        # Links are kept while their note exists in the collection, in any note type, as
+        # other languages of the same lute.db may be imported into other note types
+        existing = self.existing_note_ids(note_id for note_id, _, _ in self.linked_notes.values())
+        missing = [woid for woid, (note_id, _, _) in self.linked_notes.items()
+                   if note_id not in existing]
+        if missing:
+            if prune:
+                self.note_map.remove(self.source, missing)
+                log_info('[note_creator] Removed %d links of deleted notes', len(missing))
+            for woid in missing:
+                del self.linked_notes[woid]
 
-            # checks if term should be allowed to be created and whether its ease should be adjusted
-            for term in terms:
+    def existing_note_ids(self, note_ids: Iterable[int]) -> Set[int]:
+        """ Returns the ids of notes that still exist in the collection """
+        note_ids = list(note_ids)
+        existing = set()
+        for start in range(0, len(note_ids), ID_CHUNK):
+            ids = ','.join(str(int(note_id)) for note_id in note_ids[start:start + ID_CHUNK])
+            existing.update(self.col.db.list(f'SELECT id FROM notes WHERE id IN ({ids})'))
+        return existing
+
+    def link_notes(self, rows: List[Tuple[int, int, str, bool]]):
+        """ Stores (WoID, note id, content hash, claimed) links written in the current chunk """
+        for woid, note_id, content_hash, claimed in rows:
+            self.linked_notes[woid] = (note_id, content_hash, claimed)
+        if self.note_map is not None and rows:
+            with self.metrics.span('link_notes'):
+                self.note_map.save(self.source, rows)
+
+    def find_existing_note(self, term: LuteTerm, key: str
+                           ) -> Optional[Tuple[int, Optional[str], bool]]:
+        """ Returns (note id, content hash, claimed) of the note of a term, None if it has none """
+        # Claimed notes were not created by an import but found by their front, they are never
+        # updated; the content hash of a note found now is read when it is linked
+        # Linked terms are found by WoID without looking at the note text
+        linked = self.linked_notes.get(term.woid)
+        if linked is not None:
+            return linked
+        if self.allow_duplicates:
+            return None
+
+        # A note with the same front is claimed, also one linked to another term or one being
+        # added in this chunk (RESERVED), so later runs find the term linked to the same note
+        note_id = self.duplicate_index.get(key)
+        if note_id is None:
+            return None
+        return note_id, None, True
+
+    @staticmethod
+    def chunked(terms: Iterable, size: int) -> Iterator[List]:
+        """ Splits any iterable of terms into lists of at most size terms """
+        iterator = iter(terms)
+        while True:
+            chunk = list(islice(iterator, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def start_undo_entry(self):
+        """ Creates the undo step all chunks are merged into, before the first write """
+        if self.undo_entry is None:
+            self.undo_entry = self.col.add_custom_undo_entry(
+                f'Import LUTE terms to {self.deck_name}')
+
+    def add_notes_batch(self, terms: List[LuteTerm], selected_lang: str, deck_id: int) -> int:
+        """ Builds notes for one chunk of terms and adds them with a single bulk call """
+        requests = []
+        batch_terms = []
+        updates = {}
+        links = []
+        # (WoID, note id) of notes found by their front, linked to the term
+        claimed = []
+        # (WoID, duplicate key) of terms with the front of a note added in this chunk
+        claimed_keys = []
+        # Images of the whole chunk are resolved at once, hashed and copied in parallel
+        images = self.media.resolve(term.image for term in terms) if self.media else {}
+        with self.metrics.span('prepare'):
+            # Fields and duplicate keys of the whole chunk, normalised once per term
+            for term, normalized in zip(terms, normalize_terms(terms)):
                 if not self.should_process_term(term, selected_lang):
+                    self.metrics.count('terms_filtered')
+                    continue
+
+                # Existing notes are updated only when content of mapped fields has changed,
+                # and only notes created by an import; a note matched by its front (e.g. written
+                # by hand) is only linked as claimed
+                key = normalized[2]
+                existing = self.find_existing_note(term, key)
+                if existing is not None:
+                    note_id, stored_hash, is_claimed = existing
+                    if is_claimed:
+                        if note_id == RESERVED:
+                            claimed_keys.append((term.woid, key))
+                        elif stored_hash is None:
+                            claimed.append((term.woid, note_id))
+                        self.metrics.count('duplicates_skipped')
+                        continue
+                    content_hash = stored_hash
+                    if self.update_existing:
+                        fields = self.build_fields(normalized, images.get(term.image))
+                        content_hash = self.content_hash(fields)
+                        if content_hash != stored_hash:
+                            updates[note_id] = fields
+                    if note_id not in updates:
+                        self.metrics.count('duplicates_skipped')
+                    # Links with new content are stored for the next import
+                    if content_hash != stored_hash:
+                        links.append((term.woid, note_id, content_hash, False))
                     continue
 
-                note = self.create_note(term, self.adjust_ease)
+                note = self.create_note(term, normalized, images.get(term.image))
                 if not note:
                     continue
 
-                if self.can_add_note(term[0]):
-                    counter = self.add_note_to_deck(note, term, deck_id, counter)
+                note.tags = self.get_tags(term)
+                # Reserving the key so duplicates within the same chunk are caught too
+                self.duplicate_index.setdefault(key, RESERVED)
+                requests.append(AddNoteRequest(note=note, deck_id=deck_id))
+                batch_terms.append((term, key))
 
-            log_info(f'[note_creator] Total {counter} cards added to deck {self.deck_name}')
-            return counter
+        if updates:
+            self.update_notes_batch(updates)
 
-        except Exception as e:
-            log_error(f'[note_creator] Error creating cards: {str(e)}')
-            showInfo(f'Error creating cards: {str(e)}')
-            return 0
+        counter = 0
+        if requests:
+            self.start_undo_entry()
+            with self.metrics.span('add_notes'):
+                try:
+                    self.col.add_notes(requests)
+                    counter = len(requests)
+                except Exception as e:
+                    # Falling back to adding notes one by one so one broken note does not stop it
+                    log_error('[note_creator] Bulk add failed, adding notes one by one: %s', e)
+                    self.metrics.count('bulk_add_fallbacks')
+                    for request, (term, key) in zip(requests, batch_terms):
+                        counter = self.add_note_to_deck(request.note, term, key, deck_id,
+                                                        counter)
+            self.metrics.count('notes_added', counter)
 
-    def should_process_term(self, term, selected_lang: str) -> bool:
+            for request, (term, key) in zip(requests, batch_terms):
+                note = request.note
+                if not note.id:
+                    continue
+                self.duplicate_index[key] = note.id
+                self.scheduler.add(term.status, note.id)
+                links.append((term.woid, note.id, self.content_hash(note.fields), False))
+            log_info('[note_creator] Added chunk of %d notes', counter)
+
+        # Terms with the front of a note added in this chunk claim it once it has an id
+        claimed.extend((woid, self.duplicate_index[key]) for woid, key in claimed_keys
+                       if self.duplicate_index.get(key))
+        if claimed:
+            # Linked with the hash of their current fields, flagged so they are never updated
+            hashes = self.load_content_hashes([note_id for _, note_id in claimed])
+            links.extend((woid, note_id, hashes[note_id], True) for woid, note_id in claimed
+                         if note_id in hashes)
+
+        # Links of the chunk are written in one transaction right after its notes
+        self.link_notes(links)
+        return counter
+
+    def update_notes_batch(self, updates: Dict[int, List[str]]):
+        """ Writes changed mapped fields of existing notes with a single bulk call """
+        notes = []
+        self.start_undo_entry()
+        with self.metrics.span('update_notes'):
+            for note_id, fields in updates.items():
+                note = self.col.get_note(note_id)
+                note.fields[:len(fields)] = fields
+                notes.append(note)
+            self.col.update_notes(notes)
+        self.updated += len(notes)
+        self.metrics.count('notes_updated', len(notes))
+        log_info('[note_creator] Updated chunk of %d notes', len(notes))
+
+    def should_process_term(self, term: LuteTerm, selected_lang: str) -> bool:
         """ Returns true for terms meeting all set conditions that should be turned into notes """
-        # term[2] is WoLgID (filter for selected language) - rest of filters moved to database.py
-        return term[2] == selected_lang
+        # Language is already filtered in SQL - kept as a safety check for mixed term lists
+        return term.language_id == selected_lang
+
+    @staticmethod
+    def build_fields(normalized: Normalized, image: Optional[str] = None) -> List[str]:
+        """ Returns contents of the note fields mapped from a normalised LUTE term """
+        front, back, _ = normalized
+        # Image of the term (media file name) is shown below the translation
+        if image:
+            back += '<br>' + MediaImporter.image_tag(image)
+        return [front, back]
 
-    def create_note(self, term, adjust_ease: bool) -> Optional[Note]:
+    @staticmethod
+    def content_hash(fields: List[str]) -> str:
+        """ Hash of the mapped fields, used to detect terms changed in LUTE """
+        mapped = FIELD_SEPARATOR.join(fields[:MAPPED_FIELDS])
+        return hashlib.sha1(mapped.encode('utf-8')).hexdigest()
+
+    def create_note(self, term: LuteTerm, normalized: Normalized,
+                    image: Optional[str] = None) -> Optional[Note]:
         """ Handles creation of notes from Lute terms """
         try:
-            note = Note(model=mw.col.models.by_name(self.model_name), col=mw.col)
-            zws = '\u200B'
-            # term[0] is WoText and term[1] is WoTranslation (both) from table words
-            # zws = '\u200B' is zero width space used for multi-word terms in Lute, removed for Anki
-            note.fields[0] = term[0].replace(zws, '')
-            note.fields[1] = term[1].replace(zws, '').replace('\r\n', '<br>')
-
-            if adjust_ease:
-                """ Assigning ease based on LUTE status using default 250% for Status=3, """
-                """ increasing/decreasing the ease by 15% for each lower/higher level, """
-                """ capping it at 300% for Well-Known, Ignored (term[8] is LUTE status) """
-                note.ease = min(2500 + (term[8] - 3) * 150, 3000)
-
+            note = Note(model=self.model or self.col.models.by_name(self.model_name), col=self.col)
+            note.fields[:MAPPED_FIELDS] = self.build_fields(normalized, image)
             return note
         except Exception as e:
-            log_error(f'[note_creator] Error creating {term} note: {e}')
+            self.log_note_error('[note_creator] Error creating %s note: %s', term, e)
             return None
 
-    def can_add_note(self, term_front: str) -> bool:
-        # Checks whether identical note or note for the same term already exist
-        existing_notes = mw.col.find_notes(f'Front:"{term_front}"')
-        return not existing_notes or self.allow_duplicates
+    def load_content_hashes(self, note_ids: List[int]) -> Dict[int, str]:
+        """ Returns {note id: content hash} of the mapped fields of notes, with one query """
+        ids = ','.join(str(int(note_id)) for note_id in note_ids)
+        return {note_id: self.content_hash(fields.split(FIELD_SEPARATOR, MAPPED_FIELDS))
+                for note_id, fields in self.col.db.all(
+                    f'SELECT id, flds FROM notes WHERE id IN ({ids})')}
+
+    def build_duplicate_index(self):
+        """ Loads first fields of all notes of the selected note type once per import run """
+        self.duplicate_index = {}
+        model = self.model or self.col.models.by_name(self.model_name)
+        if not model:
+            return
 
-    def add_note_to_deck(self, note: Note, term, deck_id: int,
+        for note_id, fields in self.col.db.all('SELECT id, flds FROM notes WHERE mid = ?',
+                                               model['id']):
+            front = fields.split(FIELD_SEPARATOR, 1)[0]
+            # Keys of note fronts match keys of the terms the notes were created from
+            self.duplicate_index.setdefault(field_key(front), note_id)
+        log_info('[note_creator] Duplicate index built with %d entries', len(self.duplicate_index))
+
+    def add_note_to_deck(self, note: Note, term: LuteTerm, key: str, deck_id: int,
                          counter: int) -> int:
         # Adds tags to note and then adds it into deck
         try:
             tags = self.get_tags(term)
             if tags:
                 note.tags = tags
-            mw.col.add_note(note, deck_id)
-            log_info(f'[note_creator] Note created for term: {term[0]}')
+            self.col.add_note(note, deck_id)
+            # Registering the new note so duplicates within the same run are caught too
+            self.duplicate_index[key] = note.id
             return counter + 1
         except Exception as e:
-            log_error(f'[note_creator] Error creating note for term {term[0]}: {str(e)}')
+            # Releasing the key reserved in add_notes_batch for a note that was not added
+            if self.duplicate_index.get(key) == RESERVED:
+                del self.duplicate_index[key]
+            self.log_note_error('[note_creator] Error creating note for term %s: %s', term.text, e)
             return counter
 
-    def get_tags(self, term) -> List[str]:
-        # Copies tags from Lute and adds tags specified in GUI
+    def log_note_error(self, message: str, *args):
+        """ Logs only the first errors of single notes, so a broken import does not flood it """
+        self.note_errors += 1
+        self.metrics.count('errors')
+        if self.note_errors <= LOGGED_NOTE_ERRORS:
+            log_error(message, *args)
+
+    def get_tags(self, term: LuteTerm) -> List[str]:
+        # Copies tags from Lute (separated by spaces) and adds tags specified in GUI
         tags = self.tags.copy()
-        if term[4] and self.import_tags:
-            tags.append(term[4])
+        if term.tags and self.import_tags:
+            tags.extend(tag for tag in term.tags.split() if tag not in tags)
         return tags
@@ -0,0 +1,131 @@
+# note_map.py
+import os
+from pathlib import Path
+import sqlite3
+from typing import Dict, Iterable, Set, Tuple
+from .logger import log_info
+
+# File name of the mapping store, kept next to the collection of the profile
+NOTE_MAP_FILE = 'lute_note_map.db'
+
+
+class NoteMap:
+    """ Sidecar store linking LUTE terms (database path, WoID) to created Anki notes """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            # Previews must not create or change the store
+            self.conn = self.connect_read_only(path)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.create_tables(self.conn)
+        # A store written before links were flagged as claimed is read (read-only) as created
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(term_notes)')}
+        self.claimed_column = 'claimed' if 'claimed' in columns else '0'
+
+    @staticmethod
+    def create_tables(conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS term_notes (
+                source TEXT NOT NULL,
+                woid INTEGER NOT NULL,
+                note_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                claimed INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (source, woid)
+            ) WITHOUT ROWID
+        """)
+        # Notes found by their front (e.g. written by hand) are linked as claimed, so imports
+        # never update them; stores of earlier versions get the column added
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(term_notes)')}
+        if 'claimed' not in columns:
+            conn.execute('ALTER TABLE term_notes ADD COLUMN claimed INTEGER NOT NULL DEFAULT 0')
+        # Content hashes of LUTE images, so unchanged image files are not hashed again
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                path TEXT NOT NULL PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+
+    @staticmethod
+    def connect_read_only(path: str) -> sqlite3.Connection:
+        """ Opens an existing store read-only, or an empty one in memory if there is none yet """
+        if os.path.exists(path):
+            # Escaped file URI, so characters like # in the profile folder do not cut the path
+            conn = sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True)
+            tables = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if {'term_notes', 'image_hashes'} <= tables:
+                return conn
+            conn.close()
+        conn = sqlite3.connect(':memory:')
+        NoteMap.create_tables(conn)
+        return conn
+
+    @staticmethod
+    def path_for_collection(col) -> str:
+        """ Mapping is stored per profile, as note ids only make sense in one collection """
+        return os.path.join(os.path.dirname(col.path), NOTE_MAP_FILE)
+
+    @staticmethod
+    def source_key(db_path: str) -> str:
+        return os.path.abspath(db_path)
+
+    def load(self, source: str) -> Dict[int, Tuple[int, str, bool]]:
+        """ Returns {WoID: (note id, content hash, claimed)} of all terms imported from source """
+        cursor = self.conn.execute(
+            f'SELECT woid, note_id, content_hash, {self.claimed_column} FROM term_notes'
+            ' WHERE source = ?', (source,))
+        links = {woid: (note_id, content_hash, bool(claimed))
+                 for woid, note_id, content_hash, claimed in cursor}
+        log_info('[note_map] Loaded %d linked notes for %s', len(links), source)
+        return links
+
+    @staticmethod
+    def load_linked_woids(path: str, db_path: str) -> Set[int]:
+        """ Returns WoIDs of terms of a lute.db linked to notes, without creating the store """
+        if not os.path.exists(path):
+            return set()
+        conn = sqlite3.connect(path)
+        try:
+            cursor = conn.execute('SELECT woid FROM term_notes WHERE source = ?',
+                                  (NoteMap.source_key(db_path),))
+            return {row[0] for row in cursor}
+        finally:
+            conn.close()
+
+    def save(self, source: str, rows: Iterable[Tuple[int, int, str, bool]]):
+        """ Writes (WoID, note id, content hash, claimed) rows of one batch in one transaction """
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO term_notes (source, woid, note_id, content_hash, claimed)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                ((source, woid, note_id, content_hash, int(claimed))
+                 for woid, note_id, content_hash, claimed in rows))
+
+    def remove(self, source: str, woids: Iterable[int]):
+        """ Drops links of terms whose notes no longer exist in the collection """
+        with self.conn:
+            self.conn.executemany('DELETE FROM term_notes WHERE source = ? AND woid = ?',
+                                  ((source, woid) for woid in woids))
+
+    def load_image_hashes(self) -> Dict[str, Tuple[int, int, str]]:
+        """ Returns {image path: (size, mtime in ns, content hash)} of hashed images """
+        cursor = self.conn.execute('SELECT path, size, mtime, content_hash FROM image_hashes')
+        return {path: (size, mtime, content_hash) for path, size, mtime, content_hash in cursor}
+
+    def save_image_hashes(self, rows: Iterable[Tuple[str, int, int, str]]):
+        """ Writes (image path, size, mtime in ns, content hash) rows in a single transaction """
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO image_hashes (path, size, mtime, content_hash)'
+                ' VALUES (?, ?, ?, ?)', rows)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,115 @@
+# preview.py
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+from aqt.qt import *
+from aqt.utils import tooltip
+from .normalize import clean_text, LINE_BREAKS
+from .note_creator import ADD, FILTERED, SKIP, UPDATE
+from .term import LuteTerm
+
+# Actions of a dry run that write to the collection when imported
+IMPORTED_ACTIONS = (ADD, UPDATE)
+# Choices of the action filter, '' shows all rows
+ACTION_FILTERS = ('', ADD, UPDATE, SKIP, FILTERED)
+
+
+class PreviewModel(QAbstractTableModel):
+    """ Rows of a dry run, cells are only rendered for rows visible in the view """
+    COLUMNS = ('Action', 'Term', 'Translation', 'Language', 'Status')
+
+    def __init__(self, rows: List[Tuple[str, LuteTerm]], languages: Dict[Any, str], parent=None):
+        super().__init__(parent)
+        self.rows = rows
+        self.languages = languages
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        action, term = self.rows[index.row()]
+        column = index.column()
+        if column == 0:
+            return action
+        if column == 1:
+            return clean_text(term.text)
+        if column == 2:
+            return LINE_BREAKS.sub(' ', clean_text(term.translation))
+        if column == 3:
+            return self.languages.get(term.language_id, str(term.language_id))
+        return term.status
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+
+class PreviewDialog(QDialog):
+    """ Shows what an import would do and imports only the selected terms """
+
+    def __init__(self, rows: List[Tuple[str, LuteTerm]], languages: Dict[Any, str],
+                 on_import: Callable[[List[LuteTerm]], None], parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Import preview')
+        self.resize(800, 600)
+        self.on_import = on_import
+        self.model = PreviewModel(rows, languages, self)
+        # Filtering by action keeps the rows in the model, the proxy only maps visible ones
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterKeyColumn(0)
+
+        counts = Counter(action for action, _ in rows)
+        summary = ', '.join(f'{counts[action]} {action}' for action in ACTION_FILTERS[1:])
+        self.summary_label = QLabel(f'{len(rows)} terms: {summary}\n'
+                                    'Select rows (Ctrl+A for all shown) to import only them.',
+                                    self)
+
+        self.filter_options = QComboBox(self)
+        for action in ACTION_FILTERS:
+            self.filter_options.addItem(action or 'all', action)
+        self.filter_options.currentIndexChanged.connect(self.filter_rows)
+
+        self.table = QTableView(self)
+        self.table.setModel(self.proxy)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        # Fixed row heights, so the view does not measure all rows of large previews
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.import_button = QPushButton('Import selected terms', self)
+        self.import_button.clicked.connect(self.import_selected)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.summary_label)
+        filter_layout = QFormLayout()
+        filter_layout.addRow('Show:', self.filter_options)
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.table)
+        layout.addWidget(self.import_button)
+
+    def filter_rows(self):
+        action = self.filter_options.currentData()
+        self.proxy.setFilterRegularExpression(f'^{action}$' if action else '')
+
+    def selected_terms(self) -> List[LuteTerm]:
+        """ Selected terms that would be added or updated, skipped ones are left out """
+        rows = sorted(self.proxy.mapToSource(index).row()
+                      for index in self.table.selectionModel().selectedRows())
+        return [self.model.rows[row][1] for row in rows
+                if self.model.rows[row][0] in IMPORTED_ACTIONS]
+
+    def import_selected(self):
+        terms = self.selected_terms()
+        if not terms:
+            tooltip('No selected terms would be added or updated.', parent=self)
+            return
+        self.accept()
+        self.on_import(terms)
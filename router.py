@@ -0,0 +1,152 @@
+# router.py
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from .logger import log_error, log_info
+from .media import MediaImporter
+from .metrics import RunMetrics
+from .normalize import normalize_terms
+from .note_creator import BATCH_SIZE, FILTERED, NoteCreator
+from .term import LuteTerm
+
+
+class LanguageRouter:
+    """ Imports several languages in one pass, each into the deck and note type of its route """
+
+    def __init__(self, routes: Dict[int, Dict[str, Any]], allow_duplicates: bool,
+                 import_tags: bool, adjust_ease: bool, update_existing: bool = False,
+                 source: Optional[str] = None, col=None, metrics: Optional[RunMetrics] = None,
+                 media: Optional[MediaImporter] = None, well_known_cards: str = ''):
+        if col is None:
+            # Collection of the profile open in Anki, outside of Anki it has to be passed
+            from aqt import mw
+            col = mw.col
+        self.col = col
+        self.metrics = metrics or RunMetrics('router')
+        # One creator per routed language (LgID), all sharing the collection and metrics
+        self.creators = {
+            language_id: NoteCreator(
+                model_name=route['model'],
+                deck_name=route['deck'],
+                allow_duplicates=allow_duplicates,
+                import_tags=import_tags,
+                adjust_ease=adjust_ease,
+                tags=list(route.get('tags', [])),
+                update_existing=update_existing,
+                source=source,
+                col=self.col,
+                metrics=self.metrics,
+                media=media,
+                well_known_cards=well_known_cards
+            )
+            for language_id, route in routes.items()
+        }
+        self.completed = False
+        self.cancelled = False
+        self.error = None
+        self.changes = None
+        self.processed = 0
+
+    @property
+    def added(self) -> int:
+        return sum(creator.added for creator in self.creators.values())
+
+    @property
+    def updated(self) -> int:
+        return sum(creator.updated for creator in self.creators.values())
+
+    def create_cards(self, terms: Iterable[LuteTerm],
+                     progress_callback: Optional[Callable[[int, int], None]] = None,
+                     should_cancel: Optional[Callable[[], bool]] = None,
+                     indexed: Optional[Dict[str, NoteCreator]] = None) -> int:
+        """ Adds notes for terms of all routed languages read in a single scan of lute.db """
+        log_info('[router] Starting to import %d languages', len(self.creators))
+        self.completed = False
+        self.cancelled = False
+        self.error = None
+        self.changes = None
+        self.processed = 0
+        for creator in self.creators.values():
+            creator.reset()
+        try:
+            with self.metrics.span('index'):
+                self.prepare(indexed)
+
+            # every chunk is split by language, each part written with one bulk call
+            for chunk in NoteCreator.chunked(terms, BATCH_SIZE):
+                parts = {}
+                for term in chunk:
+                    parts.setdefault(term.language_id, []).append(term)
+                for language_id, part in parts.items():
+                    creator = self.creators.get(language_id)
+                    if creator is None:
+                        self.metrics.count('terms_filtered', len(part))
+                        continue
+                    creator.import_chunk(part, language_id)
+                self.processed += len(chunk)
+                if progress_callback:
+                    progress_callback(self.processed, self.added)
+                if should_cancel and should_cancel():
+                    log_info('[router] Import cancelled after %d terms', self.processed)
+                    self.cancelled = True
+                    break
+
+            log_info('[router] Total %d cards added, %d notes updated', self.added, self.updated)
+            self.completed = not self.cancelled
+
+        except Exception as e:
+            log_error('[router] Error creating cards: %s', e)
+            self.metrics.count('errors')
+            self.error = str(e)
+
+        for creator in self.creators.values():
+            creator.finish(merge_undo=False)
+
+        # notes of all languages are merged into a single undo step
+        undo_entries = [creator.undo_entry for creator in self.creators.values()
+                        if creator.undo_entry is not None]
+        if undo_entries:
+            self.changes = self.col.merge_undo_entries(min(undo_entries))
+        return self.added
+
+    def dry_run(self, terms: Iterable[LuteTerm]) -> List[Tuple[str, LuteTerm]]:
+        """ Returns (action, term) of terms of all routed languages, without writing notes """
+        self.processed = 0
+        for creator in self.creators.values():
+            creator.reset()
+        try:
+            with self.metrics.span('index'):
+                self.prepare(prune=False)
+            rows = []
+            media = next(iter(self.creators.values())).media if self.creators else None
+            for chunk in NoteCreator.chunked(terms, BATCH_SIZE):
+                images = NoteCreator.preview_images(chunk, media)
+                for term, normalized in zip(chunk, normalize_terms(chunk)):
+                    creator = self.creators.get(term.language_id)
+                    action = FILTERED if creator is None else creator.classify(
+                        term, normalized, term.language_id, images.get(term.image))
+                    rows.append((action, term))
+                self.processed += len(chunk)
+        finally:
+            for creator in self.creators.values():
+                creator.finish(merge_undo=False)
+        log_info('[router] Dry run of %d terms of %d languages', len(rows), len(self.creators))
+        return rows
+
+    def prepare(self, indexed: Optional[Dict[str, NoteCreator]] = None, prune: bool = True):
+        """ Builds the duplicate index once per note type and loads term links once """
+        # {note type: creator holding its index}, shared by routers of several lute.db files
+        indexed = {} if indexed is None else indexed
+        for creator in self.creators.values():
+            creator.resolve_destination()
+            shared = indexed.setdefault(creator.model_name, creator)
+            if shared is creator:
+                creator.build_duplicate_index()
+            else:
+                creator.share_index(shared)
+
+        if not self.creators:
+            return
+        # Links of the lute.db are loaded once and shared by the creators of all languages
+        creators = list(self.creators.values())
+        creators[0].load_linked_notes(prune)
+        for creator in creators[1:]:
+            creator.share_links(creators[0])
@@ -0,0 +1,76 @@
+# scheduling.py
+from typing import Dict, List, Optional
+from .logger import log_error, log_info
+from .metrics import RunMetrics
+
+# Due days of new cards by LUTE status, '!' also sets the interval; status 1 cards stay new
+STATUS_DUE_DAYS = {2: '1-3!', 3: '3-7!', 4: '7-14!', 5: '14-30!'}
+# Ignored (98) and Well-known (99) terms, only imported with include_WKI
+KNOWN_STATUSES = (98, 99)
+# Due days of cards of well-known terms when rescheduled
+KNOWN_DUE_DAYS = '365-730!'
+# What is done with new cards of well-known terms: nothing, suspend or reschedule far out
+WELL_KNOWN_ACTIONS = ('', 'suspend', 'reschedule')
+# Number of card ids in one SQL query
+ID_CHUNK = 10000
+
+
+class StatusScheduler:
+    """ Schedules cards of new notes by the LUTE status of their terms, one call per status """
+
+    def __init__(self, col, adjust_ease: bool, well_known_cards: str = '',
+                 metrics: Optional[RunMetrics] = None):
+        self.col = col
+        self.adjust_ease = adjust_ease
+        if well_known_cards not in WELL_KNOWN_ACTIONS:
+            log_error('[scheduling] Unknown well_known_cards value %s, ignored', well_known_cards)
+            well_known_cards = ''
+        self.well_known_cards = well_known_cards
+        self.metrics = metrics or RunMetrics('scheduling')
+        # {WoStatus: ids of notes added in this run}
+        self.new_notes: Dict[int, List[int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.adjust_ease or bool(self.well_known_cards)
+
+    def add(self, status: int, note_id: int):
+        """ Remembers a new note for scheduling after all notes are added """
+        if self.enabled and note_id:
+            self.new_notes.setdefault(status, []).append(note_id)
+
+    def clear(self):
+        self.new_notes = {}
+
+    def apply(self) -> int:
+        """ Schedules the cards of all remembered notes, returns the number of cards changed """
+        scheduled = 0
+        with self.metrics.span('schedule'):
+            for status, note_ids in sorted(self.new_notes.items()):
+                card_ids = self.card_ids(note_ids)
+                if not card_ids:
+                    continue
+                # Rescheduled cards keep the starting ease of their deck options: Anki has no
+                # bulk ease setter, and writing the ease with SQL would clear the undo step
+                if status in KNOWN_STATUSES and self.well_known_cards == 'suspend':
+                    self.col.sched.suspend_cards(card_ids)
+                elif status in KNOWN_STATUSES and self.well_known_cards == 'reschedule':
+                    self.col.sched.set_due_date(card_ids, KNOWN_DUE_DAYS)
+                elif self.adjust_ease and status in KNOWN_STATUSES:
+                    self.col.sched.set_due_date(card_ids, KNOWN_DUE_DAYS)
+                elif self.adjust_ease and status in STATUS_DUE_DAYS:
+                    self.col.sched.set_due_date(card_ids, STATUS_DUE_DAYS[status])
+                else:
+                    continue
+                scheduled += len(card_ids)
+                log_info('[scheduling] Scheduled %d cards of status %s', len(card_ids), status)
+        self.metrics.count('cards_scheduled', scheduled)
+        self.clear()
+        return scheduled
+
+    def card_ids(self, note_ids: List[int]) -> List[int]:
+        card_ids = []
+        for start in range(0, len(note_ids), ID_CHUNK):
+            ids = ','.join(str(int(note_id)) for note_id in note_ids[start:start + ID_CHUNK])
+            card_ids.extend(self.col.db.list(f'SELECT id FROM cards WHERE nid IN ({ids})'))
+        return card_ids
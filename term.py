@@ -0,0 +1,31 @@
+# term.py
+from typing import Optional
+
+
+class LuteTerm:
+    """ A term read from lute.db, holding only the columns used by the importer """
+    # Slots are in the order of the columns projected by LuteDatabase (see TERM_COLUMNS)
+    __slots__ = ('text', 'translation', 'language_id', 'woid', 'status', 'created',
+                 'status_changed', 'tags', 'image')
+
+    def __init__(self, text: str, translation: str, language_id: int, woid: int, status: int,
+                 created: Optional[str] = None, status_changed: Optional[str] = None,
+                 tags: Optional[str] = None, image: Optional[str] = None):
+        self.text = text
+        self.translation = translation
+        self.language_id = language_id
+        self.woid = woid
+        self.status = status
+        self.created = created
+        self.status_changed = status_changed
+        # Tags separated by spaces and WiSource of the first image, None when not projected
+        self.tags = tags
+        self.image = image
+
+    @classmethod
+    def from_row(cls, cursor, row) -> 'LuteTerm':
+        """ Row factory for sqlite cursors reading terms """
+        return cls(*row)
+
+    def __repr__(self) -> str:
+        return f'LuteTerm({self.woid}, {self.text!r})'
@@ -0,0 +1,106 @@
+# term_cache.py
+from datetime import date
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from .database import LuteDatabase
+from .logger import log_info
+
+# Order of columns in cached rows, only the ones needed to filter and count terms
+INDEX_COLUMNS = ('WoID', 'WoLgID', 'WoCreated', 'WoStatusChanged', 'WoStatus', 'HasTranslation')
+
+
+class TermCache:
+    """ In-memory index of the terms of a lute.db, used to count terms without querying LUTE """
+    # Caches are kept for the whole Anki session, one per database file
+    caches: Dict[str, 'TermCache'] = {}
+    lock = threading.RLock()
+
+    def __init__(self, db_path: str):
+        self.db_path = os.path.abspath(db_path)
+        # Size and mtime of lute.db (and its write-ahead log) when the cache was refreshed
+        self.file_state = None
+        self.terms = {}
+        self.languages = []
+        self.parent_ids = set()
+
+    @classmethod
+    def for_database(cls, db_path: str) -> 'TermCache':
+        with cls.lock:
+            key = os.path.abspath(db_path)
+            if key not in cls.caches:
+                cls.caches[key] = cls(key)
+            return cls.caches[key]
+
+    def file_signature(self) -> Optional[Tuple]:
+        signature = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.extend([stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                signature.extend([None, None])
+        return tuple(signature)
+
+    @property
+    def loaded(self) -> bool:
+        return self.file_state is not None
+
+    def is_fresh(self) -> bool:
+        """ The cache is valid as long as lute.db has not been written to """
+        return self.loaded and self.file_state == self.file_signature()
+
+    def refresh(self, db: LuteDatabase) -> 'TermCache':
+        """ Reads all terms again when lute.db was written to since the last refresh """
+        # Not read incrementally: LUTE changes translations without updating any timestamp,
+        # so only a full read keeps HasTranslation of changed terms correct
+        with self.lock:
+            if self.is_fresh():
+                return self
+            # Taken before reading, so writes during the read invalidate the cache again
+            signature = self.file_signature()
+            rows, languages, parent_ids = db.read_term_index()
+            self.terms = {row[0]: row for row in rows}
+            self.languages = languages
+            self.parent_ids = parent_ids
+            self.file_state = signature
+            log_info('[term_cache] %d terms cached for %s', len(self.terms), self.db_path)
+            return self
+
+    def count_terms(self, parents_only, empty_translation, include_WKI, cutoff_date: date,
+                    sync_cursor: Optional[Dict[str, Any]] = None,
+                    language_id=None, language_ids: Optional[Sequence] = None,
+                    sync_cursors: Optional[Dict[Any, Dict[str, Any]]] = None,
+                    include_unknown=False, linked_woids: Optional[Set[int]] = None
+                    ) -> Tuple[int, List]:
+        """ Counts cached terms with the same filters as LuteDatabase.build_sql_query """
+        # Like in lute.db queries, sync cursors only skip terms linked to a note
+        language_ids, sync_cursors = LuteDatabase.language_scope(language_id, sync_cursor,
+                                                                 language_ids, sync_cursors)
+        language_ids = set(language_ids)
+        cutoff = cutoff_date.strftime('%Y-%m-%d 00:00:00')
+        marks = {lang: (int(cursor.get('max_woid', 0)), cursor.get('last_changed', ''))
+                 for lang, cursor in sync_cursors.items() if cursor and linked_woids is not None}
+
+        count = 0
+        with self.lock:
+            for woid, lang, created, changed, status, has_translation in self.terms.values():
+                if (created or '') < cutoff:
+                    continue
+                if (not include_WKI and status > 5) or (not include_unknown and status < 1):
+                    continue
+                if not empty_translation and not has_translation:
+                    continue
+                if parents_only and woid not in self.parent_ids:
+                    continue
+                if language_ids:
+                    if lang not in language_ids:
+                        continue
+                    mark = marks.get(lang)
+                    last_changed = max(created or '', changed or '')
+                    unchanged = mark and woid <= mark[0] and last_changed <= mark[1]
+                    if unchanged and woid in linked_woids:
+                        continue
+                count += 1
+            languages = list(self.languages)
+        return count, languages